@@ -0,0 +1,71 @@
+# fill statistics on synthetic history: old list based `get_stats` vs streaming `FillStats`
+# python benchmarks/bench_fill_stats.py [fills amount ...]     - default 10000 100000 1000000
+from datetime import datetime, timedelta, timezone
+from os import path
+from time import time, perf_counter
+import tracemalloc
+import random
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from modules.fill_store import FillStats
+
+
+def old_get_stats(fills: list):
+    # `Browser.get_stats` before fills were aggregated in one pass
+    month_timestamp = int(time() - 60 * 60 * 24 * 30)
+    fill_time = lambda fill: datetime.fromisoformat(fill["timestamp"]).replace(tzinfo=timezone.utc).timestamp()
+    month_fills = [fill for fill in fills if fill_time(fill) >= month_timestamp]
+    return {
+        "volume": {
+            "month": round(sum([float(fill["price"]) * float(fill["quantity"]) for fill in month_fills]), 2),
+            "total": round(sum([float(fill["price"]) * float(fill["quantity"]) for fill in fills]), 2),
+        },
+        "orders": {
+            "month": len(set([fill["orderId"] for fill in month_fills])),
+            "total": len(set([fill["orderId"] for fill in fills])),
+        },
+        "days": {
+            "month": len(set([datetime.fromisoformat(fill["timestamp"]).strftime('%d-%m-%Y') for fill in month_fills])),
+            "total": len(set([datetime.fromisoformat(fill["timestamp"]).strftime('%d-%m-%Y') for fill in fills])),
+        },
+    }
+
+
+def generate_fills(amount: int, fills_per_order: int = 3, days: int = 200, seed: int = 1):
+    rand = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for index in range(amount):
+        yield {
+            "orderId": str(index // fills_per_order),
+            "price": f"{rand.uniform(1, 100):.2f}",
+            "quantity": f"{rand.uniform(0.1, 5):.3f}",
+            "timestamp": (now - timedelta(seconds=rand.randint(0, days * 86400))).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3],
+        }
+
+
+def run(amount: int):
+    fills = list(generate_fills(amount))
+
+    started = perf_counter()
+    old_stats = old_get_stats(fills)
+    old_time = perf_counter() - started
+
+    started = perf_counter()
+    new_stats = FillStats().add_many(iter(fills)).result()
+    new_time = perf_counter() - started
+    del fills
+
+    # fills are streamed like from `FillStore.iter_fills`, so only aggregator memory is measured
+    tracemalloc.start()
+    FillStats().add_many(generate_fills(amount)).result()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f'{amount:>9} fills | old {old_time:6.2f}s | new {new_time:6.2f}s | '
+          f'new peak memory {peak_memory / 2 ** 20:6.1f} MB | same result: {old_stats == new_stats}')
+
+
+if __name__ == '__main__':
+    for amount in [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]:
+        run(amount)
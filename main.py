@@ -1,11 +1,14 @@
 from random import choice, random
-from os import name as os_name
+from os import name as os_name, path
+from queue import Empty
 from time import time
+import multiprocessing
 import asyncio
 
-from modules.utils import sleeping, logger, sleep, choose_mode
+from modules.utils import async_sleeping, logger, sleep, choose_mode
 from modules.retry import DataBaseError
 from modules import *
+from modules.metrics import metrics  # after `*`, it brings `modules.metrics` submodule with the same name
 import settings
 
 
@@ -16,6 +19,7 @@ def initialize_account(module_data: dict, event_name: str | None = None):
         db=db,
         proxy=module_data["proxy"],
         label=module_data["label"],
+        ip_owner=event_name,
     )
     return Backpack(
         api_key=module_data["api_key"],
@@ -29,106 +33,282 @@ def initialize_account(module_data: dict, event_name: str | None = None):
 
 
 async def run_modules(mode: int):
-    while True:
-        module_data = None
-        print('')
-        try:
-            module_data = db.get_random_module(mode)
-
-            if module_data == 'No more accounts left':
-                logger.success(f'All accounts done.')
-                return 'Ended'
-
-            backpack = initialize_account(module_data)
-            module_data["module_info"]["status"] = await backpack.run_mode(mode=mode, last=module_data['last'])
-
-        except Exception as err:
-            logger.error(f'[-] Web3 | Account error: {err}')
-            db.append_report(key=backpack.encoded_api_key, text=str(err), success=False)
-
-        finally:
-            if type(module_data) == dict:
-                if mode == 1:
-                    send_reports = db.remove_module(module_data=module_data)
-                else:
-                    send_reports = db.remove_account(module_data=module_data)
+    pool = WorkerPool(
+        workers=settings.CONCURRENCY["accounts"],
+        per_proxy=settings.CONCURRENCY["per_proxy"],
+        start_delay=settings.CONCURRENCY["start_delay"],
+    )
+    # with one worker there is nobody to share proxy with
+    skip = (lambda api_key: not pool.proxy_free(db.get_account_proxy(api_key))) if pool.workers > 1 else None
 
-                if send_reports and module_data['last']:
-                    reports = db.get_account_reports(key=backpack.encoded_api_key, label=backpack.label)
-                    TgReport().send_log(logs=reports)
+    async def worker(worker_index: int):
+        while True:
+            module_data = None
+            backpack = None
+            try:
+                await pool.wait_start()
+                pool.prepare_wait()
+                module_data = db.get_random_module(mode, skip=skip)
+
+                if module_data == 'No more accounts left':
+                    return 'Ended'
+                elif module_data is None:
+                    if pool.active == 0:
+                        logger.info(f'[•] Soft | All accounts left are busy by other workers')
+                    await pool.wait_release(timeout=30)
+                    continue
+
+                pool.take([module_data["proxy"]])
+                print('')
+                backpack = initialize_account(module_data)
+                module_data["module_info"]["status"] = await backpack.run_mode(mode=mode, last=module_data['last'])
+
+            except Exception as err:
+                logger.error(f'[-] Web3 | Account error: {err}')
+                if type(module_data) == dict:
+                    db.append_report(key=module_data["encoded_api_key"], text=str(err), success=False)
+
+            finally:
+                if backpack:
+                    backpack.browser.close()
+
+                if type(module_data) == dict:
+                    try:
+                        if mode == 1:
+                            send_reports = db.remove_module(module_data=module_data)
+                        else:
+                            send_reports = db.remove_account(module_data=module_data)
+
+                        if send_reports and module_data['last']:
+                            reports = db.get_account_reports(key=module_data["encoded_api_key"], label=module_data["label"])
+                            TgReport().send_log(logs=reports)
+
+                        if module_data["proxy"] == "mobile":
+                            Browser.proxy_manager.prefetch()
+                        if module_data["module_info"]["status"] is True: await async_sleeping(settings.SLEEP_AFTER_ACC)
+                        else: await async_sleeping(10)
+                    finally:
+                        # proxy is free only after cooldown, same as when accounts run one by one
+                        pool.release([module_data["proxy"]])
+
+    await pool.run(worker)
+    logger.success(f'All accounts done.')
+    return 'Ended'
+
+
+def run_shard(mode: int, shard_index: int, shards_count: int, raw_key: bytes, queue):
+    global db
+    if os_name == "nt":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-                if module_data["module_info"]["status"] is True: sleeping(settings.SLEEP_AFTER_ACC)
-                else: sleeping(10)
+    db = None
+    status = None
+    try:
+        db = DataBase(shard=(shard_index, shards_count), progress_queue=queue)
+        db.use_key(raw_key)
+        status = asyncio.run(run_with_cleanup(run_modules, mode=mode))
+    except KeyboardInterrupt:
+        pass
+    except Exception as err:
+        logger.error(f'[-] Soft | Process {shard_index + 1} error: {err}')
+    finally:
+        if db is not None:
+            db.close()
+        # every process has own metrics, server is started only by launcher
+        file_name, extension = path.splitext(settings.METRICS["file"])
+        metrics.dump(f"{file_name}_{shard_index + 1}{extension}")
+        queue.put(("status", shard_index, status))
+
+
+def run_processes(mode: int):
+    db.get_password()
+    if db.raw_key is None:  # no accounts to run
+        logger.success(f'All accounts done.')
+        return 'Ended'
+
+    # accounts of one proxy are always in one process, so some processes can get no accounts
+    shards = [shard_index for shard_index, shard_size in enumerate(db.get_shard_sizes(settings.PROCESSES)) if shard_size]
+    if len(shards) < settings.PROCESSES:
+        logger.warning(f'[!] Soft | Accounts are split between processes by proxy, '
+                       f'only {len(shards)}/{settings.PROCESSES} processes got accounts '
+                       f'("mobile" or no proxy - all accounts in one process)')
+    if len(shards) < 2:
+        logger.warning(f'[!] Soft | Running all accounts in this process')
+        return asyncio.run(run_with_cleanup(run_modules, mode=mode))
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    processes = {
+        shard_index: context.Process(target=run_shard, args=(mode, shard_index, settings.PROCESSES, db.raw_key, queue))
+        for shard_index in shards
+    }
+    for process in processes.values():
+        process.start()
+    logger.info(f'[•] Soft | Started {len(processes)} processes')
+
+    progress = {}
+    statuses = {}
+    while any(process.is_alive() for process in processes.values()) or not queue.empty():
+        try:
+            message = queue.get(timeout=1)
+        except Empty:
+            continue
+
+        if message[0] == "progress":
+            progress[message[1]] = message[2:]
+            accs_done = sum(shard_progress[0] for shard_progress in progress.values())
+            if accs_done != db.window_name.accs_done:
+                db.window_name.accs_done = accs_done
+                db.window_name.modules_done = sum(shard_progress[1] for shard_progress in progress.values())
+                db.window_name.update_name()
+                logger.info(f'[•] Soft | Progress: {accs_done}/{db.window_name.accs_amount} accounts done')
+        elif message[0] == "status":
+            statuses[message[1]] = message[2]
+
+    for process in processes.values():
+        process.join()
+
+    failed = [
+        str(shard_index + 1)
+        for shard_index, process in processes.items()
+        if process.exitcode != 0 or statuses.get(shard_index) != 'Ended'
+    ]
+    if failed:
+        logger.error(f'[-] Soft | Processes {", ".join(failed)} stopped before all accounts were done')
+        return None
+
+    logger.success(f'All accounts done in {len(processes)} processes.')
+    return 'Ended'
+
+
+async def run_with_cleanup(runner, **kwargs):
+    try:
+        return await runner(**kwargs)
+    finally:
+        await TgReport.notifier.flush()
+        await Browser.session_pool.close()
 
 
 async def run_many_accs():
     db.window_name.set_accs(accs_amount=db.get_pair_count())
-    while True:
-        pair_modules = None
-        futures_to_sell = None
-        pair_index = False
-        completed = False
-        random_token = choice(settings.TOKENS_TO_TRADE)
-        event_name = f"{random_token}_{int(time() * 1e3)}"
-
-        print('')
-        try:
-            futures_to_sell = db.get_random_futures_to_sell()
-            if futures_to_sell and (
-                    settings.SELL_CHANCE > random() * 100 or
-                    db.get_accs_left() < 2
-            ):
-                pair_modules = futures_to_sell["pair_modules"]
-                event_name = futures_to_sell["event_name"]
-
-            else:
-                futures_to_sell = None
-                pair_modules = db.get_pair_modules()
-                if pair_modules == 'No more accounts left':
-                    logger.success(f'All accounts done.')
-                    return 'Ended'
+    pool = WorkerPool(
+        workers=settings.CONCURRENCY["pairs"],
+        per_proxy=settings.CONCURRENCY["per_proxy"],
+        start_delay=settings.CONCURRENCY["start_delay"],
+        name="pairs",
+    )
+    if pool.workers > 1:
+        # accounts of pairs in flight can't be taken by another pair
+        skip_account = lambda api_key: not pool.account_free(api_key, Browser.get_proxy_key(db.get_account_proxy(api_key)))
+        skip_future = lambda account: not pool.account_free(account["encoded_api_key"], Browser.get_proxy_key(account.get("proxy")))
+    else:
+        skip_account = skip_future = None
+
+    async def worker(worker_index: int):
+        while True:
+            pair_modules = None
+            futures_to_sell = None
+            pair_index = False
+            completed = False
+            backpacks = []
+            random_token = choice(settings.TOKENS_TO_TRADE)
+            event_name = f"{random_token}_{int(time() * 1e3)}_{worker_index}"
+
+            try:
+                await pool.wait_start()
+                pool.prepare_wait()
+                # sell or open is decided for every free slot
+                futures_to_sell = db.get_random_futures_to_sell(skip=skip_future)
+                if futures_to_sell and (
+                        settings.SELL_CHANCE > random() * 100 or
+                        db.get_accs_left() < 2
+                ):
+                    pair_modules = futures_to_sell["pair_modules"]
+                    event_name = futures_to_sell["event_name"]
 
-            backpack1 = initialize_account(pair_modules[0], event_name)
-            backpack2 = initialize_account(pair_modules[1], event_name)
-
-            completed, pair_index = await FuturesPair(backpack1, backpack2).run(
-                buy=not futures_to_sell,
-                token_name=random_token
-            )
-
-        except Exception as err:
-            logger.error(f'[-] Web3 | Futures error: {err}')
-            db.append_report(key=event_name, text=str(err), success=False)
-
-        finally:
-            if type(pair_modules) == list:
-                if futures_to_sell:
-                    if completed:
-                        db.remove_future_to_sell(event_name=event_name)
-                        label = f"Sell {futures_to_sell['info']['token_name']}"
-                        pair_index = futures_to_sell["info"]["pair_index"]
-                    else:
-                        label = ""
                 else:
-                    db.remove_pairs(pair_modules=pair_modules, completed=completed)
-                    if pair_index:
-                        label = f"Buy {random_token}"
-                    else:
-                        label = ""
-
-                reports = db.get_account_reports(key=event_name, label=label, account_index=pair_index)
-                if reports:
-                    TgReport().send_log(logs=reports)
-
-                if completed: sleeping(settings.SLEEP_AFTER_ACC)
-                else: sleeping(10)
+                    if futures_to_sell:
+                        db.release_future_to_sell(event_name=futures_to_sell["event_name"])
+                    futures_to_sell = None
+                    pair_modules = db.get_pair_modules(skip=skip_account)
+                    if pair_modules == 'No more accounts left':
+                        if pool.active and db.storage.count_futures():
+                            # positions opened by other slots will be sold after they finish
+                            await pool.wait_release(timeout=30)
+                            continue
+                        return 'Ended'
+                    elif pair_modules is None:
+                        if pool.active == 0:
+                            logger.info(f'[•] Soft | All accounts left are busy by other workers')
+                        await pool.wait_release(timeout=30)
+                        continue
+
+                pool.take(
+                    proxies=[Browser.get_proxy_key(module["proxy"]) for module in pair_modules],
+                    accounts=[module["encoded_api_key"] for module in pair_modules],
+                )
+                print('')
+                backpacks = [
+                    initialize_account(pair_modules[0], event_name),
+                    initialize_account(pair_modules[1], event_name),
+                ]
+
+                completed, pair_index = await FuturesPair(*backpacks).run(
+                    buy=not futures_to_sell,
+                    token_name=random_token
+                )
+
+            except Exception as err:
+                logger.error(f'[-] Web3 | Futures error: {err}')
+                db.append_report(key=event_name, text=str(err), success=False)
+
+            finally:
+                for backpack in backpacks:
+                    backpack.browser.close()
+
+                if type(pair_modules) == list:
+                    try:
+                        if futures_to_sell:
+                            if completed:
+                                db.remove_future_to_sell(event_name=event_name)
+                                label = f"Sell {futures_to_sell['info']['token_name']}"
+                                pair_index = futures_to_sell["info"]["pair_index"]
+                            else:
+                                db.release_future_to_sell(event_name=event_name)
+                                label = ""
+                        else:
+                            db.remove_pairs(pair_modules=pair_modules, completed=completed)
+                            if pair_index:
+                                label = f"Buy {random_token}"
+                            else:
+                                label = ""
+
+                        reports = db.get_account_reports(key=event_name, label=label, account_index=pair_index)
+                        if reports:
+                            TgReport().send_log(logs=reports)
+
+                        if "mobile" in [module["proxy"] for module in pair_modules]:
+                            Browser.proxy_manager.prefetch()
+                        if completed: await async_sleeping(settings.SLEEP_AFTER_ACC)
+                        else: await async_sleeping(10)
+                    finally:
+                        pool.release(
+                            proxies=[Browser.get_proxy_key(module["proxy"]) for module in pair_modules],
+                            accounts=[module["encoded_api_key"] for module in pair_modules],
+                        )
+
+    await pool.run(worker)
+    logger.success(f'All accounts done.')
+    return 'Ended'
 
 
 if __name__ == '__main__':
     if os_name == "nt":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+    db = None
     try:
+        metrics.serve(settings.METRICS["port"])
         db = DataBase()
 
         while True:
@@ -140,12 +320,16 @@ if __name__ == '__main__':
                 case 'Delete and create new':
                     db.create_modules()
 
+                case 1 | 3 | 4 if settings.PROCESSES > 1:
+                    if run_processes(mode=mode) == 'Ended': break
+                    print('')
+
                 case 1 | 3 | 4:
-                    if asyncio.run(run_modules(mode=mode)) == 'Ended': break
+                    if asyncio.run(run_with_cleanup(run_modules, mode=mode)) == 'Ended': break
                     print('')
 
                 case 2:
-                    if asyncio.run(run_many_accs()) == 'Ended': break
+                    if asyncio.run(run_with_cleanup(run_many_accs)) == 'Ended': break
                     print('')
 
         sleep(0.1)
@@ -158,4 +342,14 @@ if __name__ == '__main__':
         pass
 
     finally:
+        logger.debug(f'[•] Soft | Market data cache: {Browser.market_cache.format_stats()}')
+        logger.debug(f'[•] Soft | HTTP sessions: {Browser.session_pool.format_stats()}')
+        logger.debug(f'[•] Soft | Rate limiter: {Browser.rate_limiter.format_stats()}')
+        logger.debug(f'[•] Soft | Futures legs: {FuturesPair.format_stats()}')
+        if TgReport.notifier.pending:
+            asyncio.run(TgReport.notifier.flush())
+        if db is not None:
+            db.close()
+        metrics.dump(settings.METRICS["file"])
+        metrics.close()
         logger.info('[•] Soft | Closed')
@@ -2,6 +2,7 @@
 from .utils import WindowName, TgReport
 from .database import DataBase
 from .browser import Browser
+from .worker_pool import WorkerPool
 
 # modules
 from .backpack import Backpack, FuturesPair
\ No newline at end of file
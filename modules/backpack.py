@@ -1,14 +1,18 @@
 from random import choice, random, uniform, randint, shuffle
 from decimal import Decimal
 from loguru import logger
+from time import time
 import asyncio
 
+from .retry import is_rejected
+from .metrics import metrics
 from .browser import Browser
 from .database import DataBase
-from .utils import sleeping, cround, make_border
+from .utils import async_sleeping, cround, make_border
 from settings import (
     SLEEP_AFTER_ORDER,
     SLEEP_AFTER_FUTURE,
+    SIMULTANEOUS_LEGS,
     TOKENS_TO_TRADE,
     RANDOM_LEVERAGE,
     TRADES_AMOUNT,
@@ -112,14 +116,14 @@ class Backpack:
 
         if random_token:
             await self.sell_token(token_name=random_token, all_balance=True)
-            sleeping(SLEEP_AFTER_ORDER)
+            await async_sleeping(SLEEP_AFTER_ORDER)
 
         random_token = choice(existing_tokens)
 
         if not await self.buy_token(token_name=random_token):
             return False
 
-        sleeping(SLEEP_AFTER_ORDER)
+        await async_sleeping(SLEEP_AFTER_ORDER)
 
         return await self.sell_token(token_name=random_token)
 
@@ -148,7 +152,7 @@ class Backpack:
     async def buy_token(self, token_name: str, all_balance: bool = False):
         if all_balance:
             self.balances = await self.browser.get_balances()
-            usdc_amount = self.balances["USDC"]
+            usdc_amount = self.balances.free("USDC")
 
         elif TRADES_AMOUNT["amount"] != [0, 0]:
             usdc_amounts = TRADES_AMOUNT["amount"].copy()
@@ -176,7 +180,7 @@ class Backpack:
     async def sell_token(self, token_name: str, all_balance: bool = False):
         if all_balance:
             self.balances = await self.browser.get_balances()
-            amount = self.balances[token_name]
+            amount = self.balances.free(token_name)
 
         else:
             percent = uniform(*TRADES_AMOUNT["percent_back"]) / 100
@@ -195,7 +199,24 @@ class Backpack:
             amount: float,
             retry: int = 0,
     ):
-        self.prices = await self.browser.get_tickers()
+        if retry:  # previous order could fail because of stale price
+            self.browser.market_cache.invalidate("tickers")
+        self.prices.update(await self.browser.get_tickers(tokens=[token_name]))
+        payload = self.build_spot_payload(side=side, token_name=token_name, amount=amount)
+        order_resp = await self.browser.create_order(payload)
+        await self.process_spot_order(side=side, token_name=token_name, amount=amount, order_resp=order_resp)
+
+        self.balances = await self.browser.get_balances()
+
+        if order_resp.get("status") in ["Filled", "New"]:
+            return True
+        else:
+            if retry < RETRY and not is_rejected(order_resp.get("message")):
+                return await self.create_spot_order(side=side, token_name=token_name, amount=amount, retry=retry+1)
+            else:
+                return False
+
+    def build_spot_payload(self, side: str, token_name: str, amount: float):
         last_price = self.prices[token_name]
         if side == "Bid":
             price = cround(last_price * 1.008, self.token_decimals[token_name]["price"])
@@ -203,7 +224,7 @@ class Backpack:
             price = cround(last_price * 0.992, self.token_decimals[token_name]["price"])
         str_amount = str(round(Decimal(amount), self.token_decimals[token_name]["amount"]))
 
-        payload = {
+        return {
             "side": side,
             "symbol": f"{token_name}_USDC",
             "orderType": "Limit",
@@ -215,13 +236,15 @@ class Backpack:
             "autoLendRedeem": True,
             "autoLend": False
         }
-        order_resp = await self.browser.create_order(payload)
+
+    async def process_spot_order(self, side: str, token_name: str, amount: float, order_resp: dict):
+        last_price = self.prices[token_name]
+        str_amount = str(round(Decimal(amount), self.token_decimals[token_name]["amount"]))
 
         order_price = last_price
-        if order_resp.get("id"):
-            current_fill = await self.browser.find_fill_by_id(order_resp["id"])
-            if current_fill:
-                order_price = float(current_fill["price"])
+        current_fill = await self.browser.get_order_fill(order_resp)
+        if current_fill:
+            order_price = float(current_fill["price"])
 
         action_name = f'<blue>{self.spot_params[side]}</blue>'
         first_token = f"{str_amount} {token_name}"
@@ -275,6 +298,7 @@ class Backpack:
             )
             tg_status, tg_report = False, f"{self.spot_params[side].lower()} {first_token} for {second_token} (${order_price})"
 
+        metrics.inc("orders_total", market="spot", outcome={True: "filled", "WARNING": "open"}.get(tg_status, "failed"))
         self.db.append_report(
             key=self.event_name,
             text=tg_report,
@@ -282,16 +306,6 @@ class Backpack:
             unique_msg=True
         )
 
-        self.balances = await self.browser.get_balances()
-
-        if order_resp.get("status") in ["Filled", "New"]:
-            return True
-        else:
-            if retry < RETRY:
-                return await self.create_spot_order(side=side, token_name=token_name, amount=amount, retry=retry+1)
-            else:
-                return False
-
 
     async def create_futures_order(
             self,
@@ -303,11 +317,40 @@ class Backpack:
             leverage: int,
             retry: int = 0,
     ):
-        if need_label:
-            str_label = f"{self.label} | "
+        payload, raw_action_name, leverage_str = self.build_futures_payload(
+            side=side,
+            token_name=token_name,
+            usdc_amount=usdc_amount,
+            token_amount=token_amount,
+            leverage=leverage,
+        )
+        order_resp = await self.browser.create_order(payload)
+        tg_status = await self.process_futures_order(
+            side=side,
+            token_name=token_name,
+            raw_action_name=raw_action_name,
+            leverage_str=leverage_str,
+            need_label=need_label,
+            order_resp=order_resp,
+        )
+
+        if tg_status:
+            return self.bids_history
         else:
-            str_label = ""
+            if retry < RETRY and not is_rejected(order_resp.get("message")):
+                return await self.create_futures_order(
+                    side=side,
+                    token_name=token_name,
+                    usdc_amount=usdc_amount,
+                    token_amount=token_amount,
+                    need_label=need_label,
+                    leverage=leverage,
+                    retry=retry+1
+                )
+            else:
+                return False
 
+    def build_futures_payload(self, side: str, token_name: str, usdc_amount: float, token_amount: float, leverage: int):
         if usdc_amount:
             payload = {
                 "orderType": "Market",
@@ -337,8 +380,23 @@ class Backpack:
         else:
             raise Exception("One of `usdc_amount` or `token_amount` must be filled")
 
+        return payload, raw_action_name, leverage_str
+
+    async def process_futures_order(
+            self,
+            side: str,
+            token_name: str,
+            raw_action_name: str,
+            leverage_str: str,
+            need_label: bool,
+            order_resp: dict,
+    ):
+        if need_label:
+            str_label = f"{self.label} | "
+        else:
+            str_label = ""
+
         action_name = f'<blue>{raw_action_name}</blue>'
-        order_resp = await self.browser.create_order(payload)
 
         if order_resp.get("status") and order_resp.get("status") == "Filled":
             token_amount = float(order_resp['executedQuantity'])
@@ -349,13 +407,13 @@ class Backpack:
             tokens_str = f"{first_token} for {second_token}"
 
             order_price = 0
-            if order_resp.get("id"):
-                current_fill = await self.browser.find_fill_by_id(order_resp["id"])
-                if current_fill:
-                    order_price = float(current_fill["price"])
+            current_fill = await self.browser.get_order_fill(order_resp)
+            if current_fill:
+                order_price = float(current_fill["price"])
 
             bids_spend_str = ""
             tg_status, tg_report = True, f"{raw_action_name.lower()} {str_token_amount} {token_name} for {second_token} (${order_price}){leverage_str.lower()}"
+            metrics.inc("orders_total", market="futures", outcome="filled")
             logger.opt(colors=True).info(f'[+] Backpack | {str_label}{action_name} {tokens_str} (${order_price}){leverage_str}{bids_spend_str}')
 
             self.bids_history = {
@@ -377,6 +435,7 @@ class Backpack:
 
             logger.opt(colors=True).warning(f'[-] Backpack | {str_label}Failed to {action_name} {tokens_str} {leverage_str} | Unexpected response: {error_text}')
             tg_status, tg_report = False, f"{raw_action_name.lower()} {token_name} for USDC {leverage_str}"
+            metrics.inc("orders_total", market="futures", outcome="failed")
 
         tg_text = f"<i>{self.label}</i>\n{tg_report}\n" if need_label else tg_report
         self.db.append_report(
@@ -386,21 +445,7 @@ class Backpack:
             unique_msg=True
         )
 
-        if tg_status:
-            return self.bids_history
-        else:
-            if retry < RETRY:
-                return await self.create_futures_order(
-                    side=side,
-                    token_name=token_name,
-                    usdc_amount=usdc_amount,
-                    token_amount=token_amount,
-                    need_label=need_label,
-                    leverage=leverage,
-                    retry=retry+1
-                )
-            else:
-                return False
+        return tg_status
 
 
     async def sell_all(self):
@@ -412,7 +457,7 @@ class Backpack:
                     token_name in self.prices and
                     token_name in self.token_decimals and
                     token_name != "USDC" and not token_name.endswith("_PERP") and
-                    self.prices[token_name] * cround(self.balances[token_name], self.token_decimals[token_name]["amount"]) > 1
+                    self.prices[token_name] * cround(self.balances.free(token_name), self.token_decimals[token_name]["amount"]) > 1
             )
         ]
 
@@ -425,8 +470,9 @@ class Backpack:
             )
             return True
 
+        orders = []
         for token_name in tokens_to_sell:
-            position_amount = cround(self.balances[token_name], self.token_decimals[token_name]["amount"])
+            position_amount = cround(self.balances.free(token_name), self.token_decimals[token_name]["amount"])
             if not position_amount:
                 logger.warning(f'[-] Backpack | Low {token_name} balance ({self.balances[token_name]}) to sell')
                 self.db.append_report(
@@ -436,10 +482,12 @@ class Backpack:
                 )
                 continue
 
-            await self.sell_token(token_name, all_balance=True)
-
-            if token_name != tokens_to_sell[-1] or futures_positions:
-                sleeping(SLEEP_AFTER_ORDER)
+            orders.append({
+                "type": "spot",
+                "token_name": token_name,
+                "amount": position_amount,
+                "payload": self.build_spot_payload(side="Ask", token_name=token_name, amount=position_amount),
+            })
 
         for position in futures_positions:
             token_name = position["symbol"].removesuffix("_USDC_PERP")
@@ -458,17 +506,59 @@ class Backpack:
                 )
                 continue
 
-            await self.create_futures_order(
+            payload, raw_action_name, leverage_str = self.build_futures_payload(
                 side=side,  # reversed
                 token_name=token_name,
                 usdc_amount=0,
-                token_amount=float(position["netExposureQuantity"]),
-                need_label=False,
+                token_amount=position_amount,
                 leverage=0,
             )
-            if position != futures_positions[-1]:
-                sleeping(SLEEP_AFTER_ORDER)
+            orders.append({
+                "type": "futures",
+                "token_name": token_name,
+                "side": side,
+                "amount": position_amount,
+                "action": (raw_action_name, leverage_str),
+                "payload": payload,
+            })
+
+        if not orders:
+            return True
 
+        # all positions are closed with one batch request, failed orders are retried one by one
+        orders_resp = await self.browser.create_orders([order["payload"] for order in orders])
+        for order, order_resp in zip(orders, orders_resp):
+            if order["type"] == "spot":
+                await self.process_spot_order(
+                    side="Ask",
+                    token_name=order["token_name"],
+                    amount=order["amount"],
+                    order_resp=order_resp,
+                )
+                if order_resp.get("status") not in ["Filled", "New"]:
+                    await self.create_spot_order(side="Ask", token_name=order["token_name"], amount=order["amount"], retry=1)
+
+            else:
+                filled = await self.process_futures_order(
+                    side=order["side"],
+                    token_name=order["token_name"],
+                    raw_action_name=order["action"][0],
+                    leverage_str=order["action"][1],
+                    need_label=False,
+                    order_resp=order_resp,
+                )
+                if not filled:
+                    await self.create_futures_order(
+                        side=order["side"],
+                        token_name=order["token_name"],
+                        usdc_amount=0,
+                        token_amount=order["amount"],
+                        need_label=False,
+                        leverage=0,
+                        retry=1,
+                    )
+
+        self.balances = await self.browser.get_balances()
         return True
 
 
@@ -527,6 +617,8 @@ class Backpack:
 
 class FuturesPair:
 
+    stats: dict = {"legs": 0, "skew_total": 0, "max_skew": 0, "unwinds": 0, "unwinds_failed": 0}
+
     def __init__(self, account1: Backpack, account2: Backpack):
         self.account1 = account1
         self.account2 = account2
@@ -544,6 +636,8 @@ class FuturesPair:
             self.account1.browser.get_token_decimals(),
         )
         self.account1.token_decimals, self.account2.token_decimals = token_decimals, token_decimals
+        for account in [self.account1, self.account2]:
+            account.db.set_balance(account.encoded_api_key, account.balances.get("USDC", 0))
 
 
         if buy:
@@ -576,21 +670,36 @@ class FuturesPair:
         sides = ["Bid", "Ask"]
         random_leverage = randint(*RANDOM_LEVERAGE)
         leveraged_bid_amount = bid_amount * random_leverage
-        for account in [self.account1, self.account2]:
-            order_data = await self.create_future_order(
-                account=account,
-                leverage=random_leverage,
+        if SIMULTANEOUS_LEGS:
+            bought_futures = await self.create_future_legs(
+                legs=[
+                    {
+                        "account": account,
+                        "side": sides.pop(randint(0, len(sides) - 1)),
+                        "usdc_amount": leveraged_bid_amount,
+                        "leverage": random_leverage,
+                    }
+                    for account in [self.account1, self.account2]
+                ],
                 token_name=token_name,
-                side=sides.pop(randint(0, len(sides) - 1)),
-                usdc_amount=leveraged_bid_amount,
+                unwind=True,
             )
-            if not order_data:
-                raise Exception(f'Future order failed, cant continue working')
-            else:
-                bought_futures.append(order_data)
+        else:
+            for account in [self.account1, self.account2]:
+                order_data = await self.create_future_order(
+                    account=account,
+                    leverage=random_leverage,
+                    token_name=token_name,
+                    side=sides.pop(randint(0, len(sides) - 1)),
+                    usdc_amount=leveraged_bid_amount,
+                )
+                if not order_data:
+                    raise Exception(f'Future order failed, cant continue working')
+                else:
+                    bought_futures.append(order_data)
 
-                if account == self.account1:
-                    sleeping(SLEEP_AFTER_FUTURE)
+                    if account == self.account1:
+                        await async_sleeping(SLEEP_AFTER_FUTURE)
 
         # calculate BUY profit
         buy_profit = round(sum([
@@ -624,19 +733,37 @@ class FuturesPair:
         shuffle(accounts_list)
 
         total_profit = 0
-        for account in accounts_list:
-            order_data = await self.create_future_order(
-                account=account,
-                token_name=account.order_data["token_name"],
-                side=account.switch_params[account.order_data["side"]],
-                token_amount=account.order_data["amount"] * random_percent,
+        if SIMULTANEOUS_LEGS:
+            closed_futures = await self.create_future_legs(
+                legs=[
+                    {
+                        "account": account,
+                        "side": account.switch_params[account.order_data["side"]],
+                        "token_amount": account.order_data["amount"] * random_percent,
+                    }
+                    for account in accounts_list
+                ],
+                token_name=self.account1.order_data["token_name"],
+                unwind=False,
             )
-            if not order_data:
-                raise Exception(f'Future order failed, cant continue working')
-            else:
-                total_profit += order_data["order_data"]["usdc"] - account.order_data["usdc"]
-                if account == accounts_list[0]:
-                    sleeping(SLEEP_AFTER_FUTURE)
+            total_profit = sum([
+                order_data["order_data"]["usdc"] - account.order_data["usdc"]
+                for account, order_data in zip(accounts_list, closed_futures)
+            ])
+        else:
+            for account in accounts_list:
+                order_data = await self.create_future_order(
+                    account=account,
+                    token_name=account.order_data["token_name"],
+                    side=account.switch_params[account.order_data["side"]],
+                    token_amount=account.order_data["amount"] * random_percent,
+                )
+                if not order_data:
+                    raise Exception(f'Future order failed, cant continue working')
+                else:
+                    total_profit += order_data["order_data"]["usdc"] - account.order_data["usdc"]
+                    if account == accounts_list[0]:
+                        await async_sleeping(SLEEP_AFTER_FUTURE)
 
         profit_str = f"+{round(total_profit, 2)}" if total_profit >= 0 else f"{round(total_profit, 2)}"
         logger.info(f'[•] Backpack | Futures profit: {profit_str}$')
@@ -677,3 +804,107 @@ class FuturesPair:
             'proxy': account.browser.proxy,
             'order_data': order_data
         }
+
+
+    async def create_future_legs(self, legs: list, token_name: str, unwind: bool):
+        # leverage is changed before sending, so both orders are sent at the same moment
+        leverages_changed = await asyncio.gather(*[
+            leg["account"].change_leverage(leg["leverage"])
+            for leg in legs if leg.get("leverage")
+        ])
+        if any(leverages_changed):
+            await asyncio.sleep(randint(3,8))
+
+        for leg in legs:
+            account = leg["account"]
+            leg["usdc_amount"] = cround(leg.get("usdc_amount", 0), account.token_decimals[token_name]["tick_size"])
+            leg["token_amount"] = cround(leg.get("token_amount", 0), account.token_decimals[token_name]["amount"])
+            leg["payload"], leg["action_name"], leg["leverage_str"] = account.build_futures_payload(
+                side=leg["side"],
+                token_name=token_name,
+                usdc_amount=leg["usdc_amount"],
+                token_amount=leg["token_amount"],
+                leverage=leg.get("leverage", 0),
+            )
+
+        orders_resp = await asyncio.gather(*[self.send_leg(leg) for leg in legs])
+
+        for leg, order_resp in zip(legs, orders_resp):
+            account = leg["account"]
+            leg["filled"] = await account.process_futures_order(
+                side=leg["side"],
+                token_name=token_name,
+                raw_action_name=leg["action_name"],
+                leverage_str=leg["leverage_str"],
+                need_label=True,
+                order_resp=order_resp,
+            )
+            if not leg["filled"] and not is_rejected(order_resp.get("message")):
+                leg["filled"] = await account.create_futures_order(
+                    side=leg["side"],
+                    token_name=token_name,
+                    usdc_amount=leg["usdc_amount"],
+                    token_amount=leg["token_amount"],
+                    need_label=True,
+                    leverage=leg.get("leverage", 0),
+                    retry=1,
+                )
+                leg["filled_at"] = time()
+            if leg["filled"]:
+                leg["order_data"] = account.bids_history
+
+        filled_legs = [leg for leg in legs if leg["filled"]]
+        if len(filled_legs) == len(legs):
+            skew = round(max(leg["filled_at"] for leg in legs) - min(leg["filled_at"] for leg in legs), 3)
+            self.stats["legs"] += 1
+            self.stats["skew_total"] += skew
+            self.stats["max_skew"] = max(self.stats["max_skew"], skew)
+            logger.debug(f'[•] Backpack | Future legs skew: {skew}s')
+            return [
+                {
+                    'encoded_api_key': leg["account"].encoded_api_key,
+                    'label': leg["account"].label,
+                    'proxy': leg["account"].browser.proxy,
+                    'order_data': leg["order_data"],
+                }
+                for leg in legs
+            ]
+
+        if unwind:
+            for leg in filled_legs:
+                await self.unwind_leg(leg=leg, token_name=token_name)
+            if filled_legs:
+                raise Exception(f'Future order failed, filled leg closed')
+        raise Exception(f'Future order failed, cant continue working')
+
+    async def send_leg(self, leg: dict):
+        try:
+            order_resp = await leg["account"].browser.create_order(leg["payload"])
+        except Exception as err:
+            order_resp = {"message": str(err)}
+        leg["filled_at"] = time()
+        return order_resp
+
+    async def unwind_leg(self, leg: dict, token_name: str):
+        account = leg["account"]
+        logger.warning(f'[-] Backpack | {account.label} | Second leg failed, closing {leg["order_data"]["amount"]} {token_name}')
+        self.stats["unwinds"] += 1
+        unwound = await account.create_futures_order(
+            side=account.switch_params[leg["side"]],
+            token_name=token_name,
+            usdc_amount=0,
+            token_amount=cround(leg["order_data"]["amount"], account.token_decimals[token_name]["amount"]),
+            need_label=True,
+            leverage=0,
+        )
+        if not unwound:
+            self.stats["unwinds_failed"] += 1
+            raise Exception(f'{account.label} failed to close {token_name} {account.futures_params[leg["side"]].lower()}, position left open')
+
+    @classmethod
+    def format_stats(cls):
+        if not cls.stats["legs"] and not cls.stats["unwinds"]:
+            return "no simultaneous legs"
+        average_skew = round(cls.stats["skew_total"] / cls.stats["legs"], 3) if cls.stats["legs"] else 0
+        return (f'{cls.stats["legs"]} leg pairs, {average_skew}s avg skew, {cls.stats["max_skew"]}s max skew, '
+                f'{cls.stats["unwinds"]} unwinds ({cls.stats["unwinds_failed"]} failed)')
@@ -2,21 +2,177 @@ from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 from base64 import b64encode, b64decode
 
 from curl_cffi.requests import AsyncSession
-from requests import get, post
-from datetime import datetime
-from time import time, sleep
+from time import time, perf_counter
+from urllib.parse import urlsplit
+from collections import OrderedDict
 from json import dumps
 import asyncio
 
-from modules.retry import async_retry, retry, have_json
-from modules.utils import logger, sleeping
+from modules.retry import async_retry, have_json, HttpError
+from modules.rate_limiter import RateLimiter
+from modules.metrics import metrics, proxy_label
+from modules.proxy_manager import ProxyManager
+from modules.price_feed import PriceFeed
+from modules.fill_store import FillStore, FillStats
+from modules.utils import logger
 from modules.database import DataBase
 import settings
 
 
+class MarketDataCache:
+
+    def __init__(self, ttls: dict):
+        self.ttls = ttls
+        self.values = {}
+        self.inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "shared": 0}
+
+    async def get(self, name: str, fetch):
+        cached = self.values.get(name)
+        if cached and time() - cached[0] < self.ttls.get(name, 0):
+            self.stats["hits"] += 1
+            return cached[1]
+
+        # same request is already in flight, wait for it instead of sending one more
+        if self.inflight.get(name) and self.inflight[name].get_loop() is asyncio.get_running_loop():
+            self.stats["shared"] += 1
+            return await asyncio.shield(self.inflight[name])
+
+        self.stats["misses"] += 1
+        self.inflight[name] = asyncio.ensure_future(fetch())
+        try:
+            value = await asyncio.shield(self.inflight[name])
+            self.values[name] = (time(), value)
+            return value
+        finally:
+            if self.inflight.get(name) and self.inflight[name].done():
+                del self.inflight[name]
+
+    def invalidate(self, name: str):
+        self.values.pop(name, None)
+
+    def format_stats(self):
+        requests_amount = sum(self.stats.values())
+        if not requests_amount:
+            return "no requests"
+        saved = round((self.stats["hits"] + self.stats["shared"]) / requests_amount * 100, 1)
+        return (f'{self.stats["hits"]} hits, {self.stats["shared"]} shared, {self.stats["misses"]} misses '
+                f'({saved}% requests saved)')
+
+
+class SessionPool:
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.sessions = OrderedDict()
+        self.users = {}
+        self.stats = {"created": 0, "reused": 0, "evicted": 0}
+
+    def acquire(self, proxy: str | None, impersonate: str, factory):
+        key = (proxy, impersonate)
+        if key in self.sessions:
+            self.sessions.move_to_end(key)
+            self.stats["reused"] += 1
+        else:
+            self.sessions[key] = factory()
+            self.stats["created"] += 1
+
+        session = self.sessions[key]
+        self.users[session] = self.users.get(session, 0) + 1
+        # sessions in use are never evicted, pool stays over `max_size` until they are released
+        self.evict()
+        return session
+
+    def release(self, session: AsyncSession):
+        if session not in self.users: return
+        self.users[session] -= 1
+        if self.users[session] <= 0:
+            del self.users[session]
+            if session not in self.sessions.values():
+                self.schedule_close(session)
+            else:
+                self.evict()
+
+    def drop(self, proxy: str | None, impersonate: str | None = None):
+        # connections opened before ip change keep old ip
+        for key in [key for key in self.sessions if key[0] == proxy and impersonate in [None, key[1]]]:
+            session = self.sessions.pop(key)
+            if not self.users.get(session):
+                self.schedule_close(session)
+
+    def evict(self):
+        for key in list(self.sessions):
+            if len(self.sessions) <= self.max_size: break
+            if self.users.get(self.sessions[key]): continue
+            self.schedule_close(self.sessions.pop(key))
+            self.stats["evicted"] += 1
+
+    def schedule_close(self, session: AsyncSession):
+        try:
+            asyncio.get_running_loop().create_task(session.close())
+        except RuntimeError:  # no running loop, nothing to close connections on
+            pass
+
+    async def close(self):
+        sessions = set(self.sessions.values()) | set(self.users)
+        self.sessions.clear()
+        self.users.clear()
+        for session in sessions:
+            try: await session.close()
+            except Exception: pass
+
+    def format_stats(self):
+        requests_amount = self.stats["created"] + self.stats["reused"]
+        reuse_ratio = round(self.stats["reused"] / requests_amount * 100, 1) if requests_amount else 0
+        return (f'{len(self.sessions)} open, {self.stats["created"]} created, {self.stats["reused"]} reused '
+                f'({reuse_ratio}%), {self.stats["evicted"]} evicted')
+
+
+class BalanceSnapshot(dict):
+
+    # token -> total amount like before, split into available/locked/lent kept aside
+    def __init__(self, collateral: list, capital: dict):
+        super().__init__()
+        self.available = {}
+        self.locked = {}
+        self.lent = {}
+
+        for token_info in collateral:
+            token_name = token_info["symbol"]
+            self[token_name] = float(token_info["totalQuantity"])
+            self.available[token_name] = float(token_info.get("availableQuantity") or 0)
+            self.locked[token_name] = float(token_info.get("openOrderQuantity") or 0)
+            self.lent[token_name] = float(token_info.get("lendQuantity") or 0)
+
+        for token_name, token_info in capital.items():
+            if self.get(token_name) is not None: continue
+            self[token_name] = float(token_info["available"])
+            self.available[token_name] = float(token_info["available"])
+            self.locked[token_name] = float(token_info.get("locked") or 0)
+            self.lent[token_name] = 0
+
+    def free(self, token_name: str):
+        # amount not reserved by open orders, lent part is redeemed by exchange on trade
+        return self.available.get(token_name, 0) + self.lent.get(token_name, 0)
+
+
 class Browser:
 
     BACKPACK_API: str = "https://api.backpack.exchange/api/v1"
+    market_cache: MarketDataCache = MarketDataCache(ttls=settings.MARKET_DATA_TTL)
+    session_pool: SessionPool = SessionPool(max_size=settings.SESSION_POOL_SIZE)
+    rate_limiter: RateLimiter = RateLimiter(limits=settings.RATE_LIMITS)
+    proxy_manager: ProxyManager = ProxyManager(
+        proxy=settings.PROXY,
+        change_ip_link=settings.CHANGE_IP_LINK,
+        min_interval=settings.CHANGE_IP_INTERVAL,
+        on_change=session_pool.drop,
+    )
+    price_feed: PriceFeed | None = PriceFeed(
+        url=settings.PRICE_FEED["url"],
+        tokens=settings.TOKENS_TO_TRADE,
+        max_age=settings.PRICE_FEED["max_age"],
+    ) if settings.PRICE_FEED["enabled"] else None
 
     def __init__(
             self,
@@ -26,6 +182,7 @@ class Browser:
             db: DataBase,
             proxy: str,
             custom_session: bool = False,
+            ip_owner: str | None = None,
     ):
         self.max_retries = 5
         self.db = db
@@ -37,19 +194,34 @@ class Browser:
         if proxy is None:
             self.proxy = None
         elif proxy == "mobile":
-            self.proxy = settings.PROXY if settings.PROXY not in ['http://log:pass@ip:port', '', None] else None
+            self.proxy = self.proxy_manager.proxy
         else:
             self.proxy = "http://" + proxy.removeprefix("https://").removeprefix("http://")
 
+        # ip is changed before the first request, not here, so it can overlap with other work
+        self.need_new_ip = False
+        self.ip_change = None
+        self.ip_owner = ip_owner    # accounts with the same owner (one futures pair) share one fresh ip
         if not custom_session:
             if self.proxy:
                 logger.debug(f'[•] {self.label} | Soft | Got proxy {self.proxy}')
-                if proxy == "mobile":
-                    self.change_ip()
+                self.need_new_ip = proxy == "mobile" and self.proxy_manager.enabled
             else:
                 logger.warning(f'[•] {self.label} | Soft | You dont use proxies')
 
-        self.session = self.get_new_session()
+        self.session = self.session_pool.acquire(self.proxy, "chrome131", self.get_new_session)
+
+    def close(self):
+        self.session_pool.release(self.session)
+
+    @classmethod
+    def get_proxy_key(cls, proxy: str | None):
+        # database keeps "mobile" or "ip:port", futures to sell keep proxy resolved by browser
+        if proxy == "mobile":
+            proxy = cls.proxy_manager.proxy
+        if not proxy:
+            return None
+        return "http://" + proxy.removeprefix("https://").removeprefix("http://")
 
     def get_new_session(self):
         session = AsyncSession(
@@ -68,60 +240,74 @@ class Browser:
 
     @have_json
     async def send_request(self, **kwargs):
-        if kwargs.get("api_instruction") is not None:
-            headers = kwargs.get("headers", {})
-            headers.update(
-                self.build_headers(
-                    kwargs["api_instruction"],
-                    {**kwargs.get("params", {}), **kwargs.get("json", {})},
-                )
-            )
-            kwargs["headers"] = headers
-            del kwargs["api_instruction"]
+        return await self.limited_request(**kwargs)
 
-        if kwargs.get("session"):
-            session = kwargs["session"]
-            del kwargs["session"]
-        else:
-            session = self.session
+    async def limited_request(self, **kwargs):
+        if self.need_new_ip:
+            await self.change_ip()
 
+        api_instruction = kwargs.pop("api_instruction", None)
+        session = kwargs.pop("session", None) or self.session
         if kwargs.get("method"): kwargs["method"] = kwargs["method"].upper()
-        return await session.request(**kwargs)
-
-
-    def change_ip(self):
-        if settings.CHANGE_IP_LINK not in ['https://changeip.mobileproxy.space/?proxy_key=...&format=json', '']:
-            print('')
-            while True:
-                try:
-                    r = get(settings.CHANGE_IP_LINK)
-                    if 'mobileproxy' in settings.CHANGE_IP_LINK and r.json().get('status') == 'OK':
-                        logger.debug(f'[+] {self.label} | Proxy | Successfully changed ip: {r.json()["new_ip"]}')
-                        return True
-                    elif not 'mobileproxy' in settings.CHANGE_IP_LINK and r.status_code == 200:
-                        logger.debug(f'[+] {self.label} | Proxy | Successfully changed ip: {r.text}')
-                        return True
-                    logger.error(f'[-] {self.label} | Proxy | Change IP error: {r.text} | {r.status_code}')
-                    sleep(10)
-
-                except Exception as err:
-                    logger.error(f'[-] {self.label} | Browser | Cannot get proxy: {err}')
-
-    def build_headers(self, method: str, params: dict):
+
+        buckets = self.rate_limiter.get_buckets(self.api_key, self.proxy, api_instruction)
+        endpoint = f'{kwargs.get("method", "GET")} {urlsplit(kwargs.get("url", "")).path}'
+        for attempt in range(self.max_retries):
+            await self.rate_limiter.acquire(buckets)
+
+            # sign after waiting in queue, signature is valid only for `window` ms
+            if api_instruction is not None:
+                if type(kwargs.get("json")) == list:  # batch of instructions
+                    params = kwargs["json"]
+                else:
+                    params = {**kwargs.get("params", {}), **kwargs.get("json", {})}
+                kwargs["headers"] = {
+                    **kwargs.get("headers", {}),
+                    **self.build_headers(api_instruction, params),
+                }
+
+            started = perf_counter()
+            try:
+                r = await session.request(**kwargs)
+            except Exception as err:
+                metrics.inc("request_errors_total", endpoint=endpoint, error=type(err).__name__)
+                raise
+            metrics.observe("request_seconds", perf_counter() - started, endpoint=endpoint, proxy=proxy_label(self.proxy))
+            metrics.inc("requests_total", endpoint=endpoint, status=r.status_code)
+
+            self.rate_limiter.on_response(buckets, r.status_code, r.headers.get("Retry-After"))
+            if r.status_code != 429 or not self.rate_limiter.enabled:
+                return r
+            logger.warning(f'[-] {self.label} | Browser | Rate limited on {kwargs.get("url")}, waiting in queue')
+        return r
+
+
+    async def change_ip(self):
+        # first requests of account can be sent concurrently, ip is changed once for all of them
+        if self.ip_change is None or self.ip_change.done():
+            self.ip_change = asyncio.ensure_future(self.proxy_manager.get_fresh_ip(self.label, self.ip_owner))
+        await asyncio.shield(self.ip_change)
+
+        if self.need_new_ip:
+            self.need_new_ip = False
+            # pooled session of this proxy was dropped on ip change, take a new one
+            self.session_pool.release(self.session)
+            self.session = self.session_pool.acquire(self.proxy, "chrome131", self.get_new_session)
+
+    def build_headers(self, method: str, params: dict | list):
         ts = str(int(time() * 1e3))
         window = "5000"
         api_key, api_secret = self.api_key.split(':')
 
-        body = {
-            key: dumps(value) if type(value) == bool else value
-            for key, value in sorted(params.items())
-        }
-        body.update({
-            "timestamp": ts,
-            "window": window,
-        })
-        instruction = f"instruction={method}&" if method else ""
-        str_body = instruction + "&".join(f"{key}={value}" for key, value in body.items())
+        str_body = ""
+        for instruction_params in params if type(params) == list else [params]:
+            body = {
+                key: dumps(value) if type(value) == bool else value
+                for key, value in sorted(instruction_params.items())
+            }
+            instruction = f"instruction={method}&" if method else ""
+            str_body += instruction + "".join(f"{key}={value}&" for key, value in body.items())
+        str_body += f"timestamp={ts}&window={window}"
         signature = self.private_key.sign(str_body.encode())
         encoded_signature = b64encode(signature).decode()
 
@@ -150,14 +336,14 @@ class Browser:
             "autoRepayBorrows": True,
             # "autoRealizePnl": True,
         }
-        r = await self.session.request(
+        r = await self.limited_request(
             method="PATCH",
             url=f"{self.BACKPACK_API}/account",
             json=payload,
-            headers=self.build_headers("accountUpdate", payload),
+            api_instruction="accountUpdate",
         )
         if r.status_code != 200:
-            raise Exception(f'Error: {r.text}')
+            raise HttpError(f'Error: {r.text}', r.status_code, r.headers.get("Retry-After"))
 
         acc_info = await self.get_account_info()
         if not acc_info.get("autoLend"):
@@ -167,8 +353,22 @@ class Browser:
         return acc_info
 
 
+    async def get_tickers(self, tokens: list | None = None):
+        # `tokens` - only prices of these tokens are needed, websocket is enough if all of them are subscribed
+        if self.price_feed:
+            self.price_feed.start()
+            if tokens is not None:
+                prices = self.price_feed.get_prices(tokens)
+                if prices is not None:
+                    return prices
+
+        prices = dict(await self.market_cache.get("tickers", self.fetch_tickers))
+        if self.price_feed:
+            prices.update(self.price_feed.get_prices() or {})
+        return prices
+
     @async_retry(source="Browser", module_str="Get Tickers", exceptions=Exception)
-    async def get_tickers(self):
+    async def fetch_tickers(self):
         r = await self.send_request(
             method="GET",
             url=f"{self.BACKPACK_API}/tickers",
@@ -180,27 +380,19 @@ class Browser:
 
     @async_retry(source="Browser", module_str="Get Balances", exceptions=Exception)
     async def get_balances(self):
-        r = await self.send_request(
-            method="GET",
-            url=f"{self.BACKPACK_API}/capital/collateral",
-            api_instruction="collateralQuery",
-        )
-        balances = {
-            token_info["symbol"]: float(token_info["totalQuantity"])
-            for token_info in r.json()["collateral"]
-        }
-
-        r = await self.send_request(
-            method="GET",
-            url=f"{self.BACKPACK_API}/capital",
-            api_instruction="balanceQuery",
+        collateral_r, capital_r = await asyncio.gather(
+            self.send_request(
+                method="GET",
+                url=f"{self.BACKPACK_API}/capital/collateral",
+                api_instruction="collateralQuery",
+            ),
+            self.send_request(
+                method="GET",
+                url=f"{self.BACKPACK_API}/capital",
+                api_instruction="balanceQuery",
+            ),
         )
-
-        for token_name in r.json():
-            if balances.get(token_name) is None:
-                balances[token_name] = float(r.json()[token_name]["available"])
-
-        return balances
+        return BalanceSnapshot(collateral_r.json()["collateral"], capital_r.json())
 
 
     @async_retry(source="Browser", module_str="Create Order", exceptions=Exception)
@@ -213,8 +405,25 @@ class Browser:
         )
         return r.json()
 
-    @async_retry(source="Browser", module_str="Get Markets", exceptions=Exception)
+    # batch could be accepted before connection failed, resending it would open every order twice
+    @async_retry(source="Browser", module_str="Create Orders", exceptions=Exception, no_retry=("network",))
+    async def create_orders(self, payloads: list):
+        r = await self.send_request(
+            method="POST",
+            url=f"{self.BACKPACK_API}/orders",
+            json=payloads,
+            api_instruction="orderExecute",
+        )
+        orders_resp = r.json()
+        if type(orders_resp) != list:  # whole batch rejected
+            return [orders_resp for _ in payloads]
+        return orders_resp
+
     async def get_token_decimals(self):
+        return dict(await self.market_cache.get("markets", self.fetch_token_decimals))
+
+    @async_retry(source="Browser", module_str="Get Markets", exceptions=Exception)
+    async def fetch_token_decimals(self):
         r = await self.send_request(
             method="GET",
             url=f"{self.BACKPACK_API}/markets",
@@ -257,39 +466,58 @@ class Browser:
 
         return spot_decimals
 
-    @async_retry(source="Browser", module_str="Get Last Fills", exceptions=Exception)
-    async def find_fill_by_id(self, order_id: str, count: int = 0):
-        r = await self.send_request(
-            method="GET",
-            url="https://api.backpack.exchange/wapi/v1/history/fills",
-            params={
-                "limit": 10,
-                "offset": 0,
-            },
-            api_instruction="fillHistoryQueryAll",
-        )
-        fills = r.json()
-        for fill in fills:
-            if fill["orderId"] == order_id:
-                return fill
-        await asyncio.sleep(2)
-        if count < 11:
-            return await self.find_fill_by_id(order_id, count=count+1)
-        else:
-            logger.warning(f'[-] Backpack | Couldnt find order in 25 seconds')
-            return None
+    async def get_order_fill(self, order_resp: dict):
+        # IOC and market orders return executed amounts right in the response
+        executed_quantity = float(order_resp.get("executedQuantity") or 0)
+        executed_quote_quantity = float(order_resp.get("executedQuoteQuantity") or 0)
+        if executed_quantity and executed_quote_quantity:
+            return {
+                "orderId": order_resp.get("id"),
+                "price": str(round(executed_quote_quantity / executed_quantity, 8)),
+                "quantity": str(executed_quantity),
+            }
+
+        if order_resp.get("id") and order_resp.get("status") in ["Filled", "PartiallyFilled"]:
+            return await self.find_fill_by_id(order_resp["id"])
+        return None
+
+    @async_retry(source="Browser", module_str="Get Order Fills", exceptions=Exception)
+    async def find_fill_by_id(self, order_id: str):
+        for delay in [0, 0.5, 1, 2, 4]:
+            await asyncio.sleep(delay)
+            r = await self.send_request(
+                method="GET",
+                url="https://api.backpack.exchange/wapi/v1/history/fills",
+                params={
+                    "orderId": order_id,
+                    "limit": 1000,
+                },
+                api_instruction="fillHistoryQueryAll",
+            )
+            fills = [fill for fill in r.json() if fill["orderId"] == order_id]
+            if fills:
+                quantity = sum([float(fill["quantity"]) for fill in fills])
+                quote_quantity = sum([float(fill["price"]) * float(fill["quantity"]) for fill in fills])
+                return {
+                    "orderId": order_id,
+                    "price": str(round(quote_quantity / quantity, 8)),
+                    "quantity": str(quantity),
+                }
+
+        logger.warning(f'[-] Backpack | Couldnt find order fills in 7 seconds')
+        return None
 
     @async_retry(source="Browser", module_str="Change Leverage", exceptions=Exception)
     async def change_leverage(self, leverage: int):
         payload = {"leverageLimit": str(leverage)}
-        r = await self.session.request(
+        r = await self.limited_request(
             method="PATCH",
             url=f"{self.BACKPACK_API}/account",
             json=payload,
-            headers=self.build_headers("accountUpdate", payload),
+            api_instruction="accountUpdate",
         )
         if r.status_code != 200:
-            raise Exception(f'Error: {r.text}')
+            raise HttpError(f'Error: {r.text}', r.status_code, r.headers.get("Retry-After"))
 
         acc_info = await self.get_account_info()
         if acc_info.get("leverageLimit") != str(leverage):
@@ -308,61 +536,37 @@ class Browser:
         return r.json()
 
 
-    @async_retry(source="Browser", module_str="Get Statistics", exceptions=Exception)
-    async def get_stats(self):
+    @async_retry(source="Browser", module_str="Sync Fills", exceptions=Exception)
+    async def sync_fills(self):
+        # download only fills newer than already stored ones
+        fill_store = FillStore.get(self.api_key)
         offset = 0
-        fills = []
+        new_fills = []
 
         while True:
+            params = {
+                "limit": 1000,
+                "offset": offset,
+            }
+            if fill_store.watermark:
+                params["from"] = fill_store.watermark
             r = await self.send_request(
                 method="GET",
                 url="https://api.backpack.exchange/wapi/v1/history/fills",
-                params={
-                    "limit": 1000,
-                    "offset": offset,
-                },
+                params=params,
                 api_instruction="fillHistoryQueryAll",
             )
-            fills += r.json()
+            new_fills += r.json()
             if len(r.json()) == 1000:
                 offset += 1000
             else:
                 break
 
-        month_timestamp = int(time() - 60 * 60 * 24 * 30)
-
-        month_volume = round(sum([
-            float(fill["price"]) * float(fill["quantity"])
-            for fill in fills
-            if datetime.fromisoformat(fill["timestamp"]).timestamp() >= month_timestamp
-        ]), 2)
-        total_volume = round(sum([
-            float(fill["price"]) * float(fill["quantity"])
-            for fill in fills
-        ]), 2)
-
-        month_orders_amounts = len(set([
-            fill["orderId"]
-            for fill in fills
-            if datetime.fromisoformat(fill["timestamp"]).timestamp() >= month_timestamp
-        ]))
-        total_orders_amounts = len(set([
-            fill["orderId"]
-            for fill in fills
-        ]))
-
-        total_days_amount = len(set([
-            datetime.fromisoformat(fill["timestamp"]).strftime('%d-%m-%Y')
-            for fill in fills
-        ]))
-        month_days_amount = len(set([
-            datetime.fromisoformat(fill["timestamp"]).strftime('%d-%m-%Y')
-            for fill in fills
-            if datetime.fromisoformat(fill["timestamp"]).timestamp() >= month_timestamp
-        ]))
-
-        return {
-            "volume": {"month": month_volume, "total": total_volume},
-            "orders": {"month": month_orders_amounts, "total": total_orders_amounts},
-            "days": {"month": month_days_amount, "total": total_days_amount},
-        }
+        stored_fills = fill_store.merge(new_fills)
+        logger.debug(f'[•] {self.label} | Synced {len(stored_fills)} new fills ({fill_store.fills_amount} total)')
+        return fill_store
+
+    @async_retry(source="Browser", module_str="Get Statistics", exceptions=Exception)
+    async def get_stats(self):
+        fill_store = await self.sync_fills()
+        return FillStats().add_many(fill_store.iter_fills()).result()
@@ -4,14 +4,23 @@ from random import choice, randint
 from time import sleep, time
 from os import path, mkdir
 from hashlib import md5
-import json
 
+from modules.storage import JsonStorage, ShardedJsonStorage, SqliteStorage, StateCache
+from modules.scheduler import ModuleScheduler
+from modules.work_queue import WorkQueue
 from modules.retry import DataBaseError
-from modules.utils import logger, WindowName
+from modules.metrics import metrics
+from modules.utils import logger, WindowName, ShardWindowName
 from settings import (
     SHUFFLE_WALLETS,
+    SHARED_DATABASE,
+    DATABASE_SHARDS,
+    DATABASE_CACHE,
+    WALLETS_ORDER,
+    DATABASE_TYPE,
     TRADES_COUNT,
     PROXY_TYPE,
+    PROCESSES,
     RETRY,
 )
 
@@ -27,25 +36,77 @@ class DataBase:
         "WARNING": "⚠️ ",
     }
 
-    def __init__(self):
+    def __init__(self, shard: tuple | None = None, progress_queue=None):
 
         self.modules_db_name = 'databases/modules.json'
         self.report_db_name = 'databases/report.json'
+        self.report_journal_name = 'databases/report.jsonl'
         self.sell_futures_db_name = 'databases/sell_futures.json'
+        self.sqlite_db_name = 'databases/database.sqlite'
+        self.shards_dir = 'databases/modules'
         self.personal_key = None
+        self.raw_key = None
         self.window_name = None
+        self.scheduler = None
+        self.futures_busy = set()
+        self.balances = {}          # last known USDC balance of accounts, for pairing accounts with close balances
+        self.proxies = {}
+        self.shard = shard          # (index, count) - this process works only with own part of accounts
 
         # create db's if not exists
         if not path.isdir(self.modules_db_name.split('/')[0]):
             mkdir(self.modules_db_name.split('/')[0])
 
-        for db_params in [
-            {"name": self.modules_db_name, "value": "[]"},
-            {"name": self.report_db_name, "value": "{}"},
-            {"name": self.sell_futures_db_name, "value": "{}"},
-        ]:
-            if not path.isfile(db_params["name"]):
-                with open(db_params["name"], 'w') as f: f.write(db_params["value"])
+        if DATABASE_TYPE == "sqlite":
+            self.storage = SqliteStorage(
+                self.sqlite_db_name,
+                self.modules_db_name,
+                self.report_db_name,
+                self.report_journal_name,
+                self.sell_futures_db_name,
+                self.shards_dir,
+            )
+        elif DATABASE_TYPE == "json":
+            cache = StateCache(
+                flush_every=DATABASE_CACHE["flush_every"],
+                flush_interval=DATABASE_CACHE["flush_interval"],
+            ) if DATABASE_CACHE["enabled"] else None
+
+            if DATABASE_SHARDS:
+                self.storage = ShardedJsonStorage(
+                    self.modules_db_name,
+                    self.report_db_name,
+                    self.report_journal_name,
+                    self.sell_futures_db_name,
+                    shards_dir=self.shards_dir,
+                    shards_count=DATABASE_SHARDS,
+                    cache=cache,
+                )
+            else:
+                self.storage = JsonStorage(
+                    self.modules_db_name,
+                    self.report_db_name,
+                    self.report_journal_name,
+                    self.sell_futures_db_name,
+                    shards_dir=self.shards_dir,
+                    cache=cache,
+                )
+        else:
+            raise DataBaseError(f'Invalid DATABASE_TYPE "{DATABASE_TYPE}". Valid types: "json" | "sqlite"')
+
+        if SHARED_DATABASE["enabled"] and DATABASE_TYPE != "sqlite":
+            raise DataBaseError(f'SHARED_DATABASE works only with DATABASE_TYPE "sqlite"')
+        if PROCESSES > 1 and DATABASE_TYPE != "sqlite":
+            raise DataBaseError(f'PROCESSES works only with DATABASE_TYPE "sqlite"')
+
+        if self.shard is not None:
+            # launcher already reset failed modules and printed amounts
+            self.window_name = ShardWindowName(
+                accs_amount=self.get_scheduler().accs_left,
+                shard_index=self.shard[0],
+                queue=progress_queue,
+            )
+            return
 
         amounts = self.get_amounts()
         logger.info(f'Loaded {amounts["modules_amount"]} modules for {amounts["accs_amount"]} accounts\n')
@@ -55,6 +116,12 @@ class DataBase:
                 logger.warning(f'[!] You have {pair_count} unclosed future positions! Run `2. Futures` to close it')
 
 
+    def close(self):
+        if isinstance(self.scheduler, WorkQueue):
+            self.scheduler.close()
+        self.storage.close()
+
+
     def set_password(self):
         if self.personal_key is not None: return
 
@@ -69,26 +136,24 @@ class DataBase:
         sleep(0.2)
 
         password = md5(raw_password.encode()).hexdigest().encode()
-        self.personal_key = Fernet(urlsafe_b64encode(password))
+        self.use_key(urlsafe_b64encode(password))
 
 
     def get_password(self):
         if self.personal_key is not None: return
 
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        if modules_db:
-            test_key = list(modules_db.keys())[0]
-        else:
-            with open(self.sell_futures_db_name, encoding="utf-8") as f: futures_db = json.load(f)
+        test_key = self.storage.first_account_key()
+        if test_key is None:
+            futures_db = self.storage.get_futures()
             if futures_db:
                 test_key = futures_db[list(futures_db.keys())[0]]["accounts"][0]["encoded_api_key"]
             else:
                 return
 
         try:
-            temp_key = Fernet(urlsafe_b64encode(md5("@karamelniy dumb shit encrypting".encode()).hexdigest().encode()))
-            self.decode_pk(pk=test_key, key=temp_key)
-            self.personal_key = temp_key
+            raw_key = urlsafe_b64encode(md5("@karamelniy dumb shit encrypting".encode()).hexdigest().encode())
+            self.decode_pk(pk=test_key, key=Fernet(raw_key))
+            self.use_key(raw_key)
             return
         except InvalidToken: pass
 
@@ -98,9 +163,9 @@ class DataBase:
                 raw_password = input("")
                 password = md5(raw_password.encode()).hexdigest().encode()
 
-                temp_key = Fernet(urlsafe_b64encode(password))
-                self.decode_pk(pk=list(modules_db.keys())[0], key=temp_key)
-                self.personal_key = temp_key
+                raw_key = urlsafe_b64encode(password)
+                self.decode_pk(pk=test_key, key=Fernet(raw_key))
+                self.use_key(raw_key)
                 logger.success(f'[+] Soft | Access granted!\n')
                 return
 
@@ -108,6 +173,12 @@ class DataBase:
                 logger.error(f'[-] Soft | Invalid password\n')
 
 
+    def use_key(self, raw_key: bytes):
+        # raw key is kept to start child processes without asking password again
+        self.raw_key = raw_key
+        self.personal_key = Fernet(raw_key)
+
+
     def encode_pk(self, pk: str, key: None | Fernet = None):
         if key is None:
             return self.personal_key.encrypt(pk.encode()).decode()
@@ -146,7 +217,7 @@ class DataBase:
         elif PROXY_TYPE == "mobile":
             proxies = ["mobile" for _ in range(len(api_keys))]
 
-        with open(self.report_db_name, 'w') as f: f.write('{}')  # clear report db
+        self.storage.clear_reports()
 
         new_modules = {
             self.encode_pk(api_key): {
@@ -159,7 +230,8 @@ class DataBase:
             for api_key, proxy, label in zip(only_keys, proxies, labels)
         }
 
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(new_modules, f)
+        self.storage.replace_accounts(new_modules)
+        self.reset_scheduler()
 
         amounts = self.get_amounts()
         logger.critical(f'Dont Forget To Remove Api Keys from api_keys.txt!')
@@ -167,214 +239,276 @@ class DataBase:
 
 
     def get_amounts(self):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        modules_len = sum([len(modules_db[acc]["modules"]) for acc in modules_db])
-
-        for acc in modules_db:
-            for index, module in enumerate(modules_db[acc]["modules"]):
-                if module["status"] == "failed": modules_db[acc]["modules"][index]["status"] = "to_run"
-
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(modules_db, f)
+        self.storage.reset_failed()
+        self.reset_scheduler()
+        amounts = self.storage.get_amounts()
 
         if self.window_name == None:
-            self.window_name = WindowName(accs_amount=len(modules_db))
+            self.window_name = WindowName(accs_amount=amounts["accs_amount"])
         else:
-            self.window_name.accs_amount = len(modules_db)
+            self.window_name.accs_amount = amounts["accs_amount"]
 
-        self.window_name.set_modules(modules_amount=modules_len)
+        self.window_name.set_modules(modules_amount=amounts["modules_amount"])
 
-        return {'accs_amount': len(modules_db), 'modules_amount': modules_len}
+        return amounts
 
     def get_accs_left(self):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        return len(set([
-            acc
-            for acc in modules_db
-            for module in modules_db[acc]["modules"]
-            if module["status"] == "to_run"
-        ]))
+        return self.get_scheduler().accs_left
 
     def get_pair_count(self):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        with open(self.sell_futures_db_name, encoding="utf-8") as f: futures_db = json.load(f)
-        pair_count = sum([len(modules_db[acc]["modules"]) for acc in modules_db])
+        pair_count = self.storage.get_amounts()["modules_amount"]
         if pair_count % 2:
             pair_count -= 1
-        return int(pair_count / 2) + len(futures_db)
-
-    def get_random_module(self, mode: int):
-        self.get_password()
+        return int(pair_count / 2) + self.storage.count_futures()
+
+    def get_scheduler(self):
+        if self.scheduler is None:
+            policy = WALLETS_ORDER or ("random" if SHUFFLE_WALLETS else "sequential")
+            if SHARED_DATABASE["enabled"]:
+                # accounts are claimed in sqlite, so several processes can share one database
+                self.scheduler = WorkQueue(storage=self.storage, policy=policy, lease=SHARED_DATABASE["lease"])
+            else:
+                self.scheduler = ModuleScheduler(policy=policy, balances=self.balances)
+                modules_db = self.storage.get_accounts()
+                for api_key in modules_db:
+                    if self.in_shard(modules_db[api_key]):
+                        self.proxies[api_key] = modules_db[api_key].get("proxy")
+                        if modules_db[api_key].get("usdc_balance") is not None:
+                            self.balances.setdefault(api_key, modules_db[api_key]["usdc_balance"])
+                        self.scheduler.add(api_key, self.count_to_run(modules_db[api_key]))
+        return self.scheduler
+
+    def in_shard(self, account: dict):
+        if self.shard is None: return True
+        return self.get_shard_index(account, self.shard[1]) == self.shard[0]
+
+    @staticmethod
+    def get_shard_index(account: dict, shards_count: int):
+        # split by proxy, so one ip is never used by two processes at once
+        return int(md5(str(account.get("proxy")).encode()).hexdigest(), 16) % shards_count
+
+    def get_shard_sizes(self, shards_count: int):
+        shard_sizes = [0] * shards_count
+        for account in self.storage.get_accounts().values():
+            if self.count_to_run(account):
+                shard_sizes[self.get_shard_index(account, shards_count)] += 1
+        return shard_sizes
+
+    def reset_scheduler(self):
+        if not isinstance(self.scheduler, WorkQueue):
+            self.scheduler = None
+
+    def count_to_run(self, account: dict | None):
+        if account is None: return 0
+        return [module["status"] for module in account["modules"]].count('to_run')
+
+    def build_module_data(self, api_key: str, account: dict):
+        return {
+            'api_key': self.decode_pk(pk=api_key),
+            'encoded_api_key': api_key,
+            'label': account["label"],
+            'proxy': account.get("proxy"),
+            'module_info': dict(choice([module for module in account["modules"] if module["status"] == "to_run"])),
+        }
 
-        last = False
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
+    def get_account_proxy(self, api_key: str):
+        if api_key in self.proxies:
+            return self.proxies[api_key]
+        account = self.storage.get_account(api_key)
+        return account.get("proxy") if account else None
 
-        if (
-                not modules_db or
-                [module["status"] for acc in modules_db for module in modules_db[acc]["modules"]].count('to_run') == 0
-        ):
-                return 'No more accounts left'
+    def set_balance(self, api_key: str, balance: float):
+        self.balances[api_key] = balance
 
-        index = 0
-        while True:
-            if index == len(modules_db.keys()) - 1: index = 0
-            if SHUFFLE_WALLETS: api_key = choice(list(modules_db.keys()))
-            else: api_key = list(modules_db.keys())[index]
-            module_info = choice(modules_db[api_key]["modules"])
-            if module_info["status"] != "to_run":
-                index += 1
-                continue
-
-            # simulate db
-            for module in modules_db[api_key]["modules"]:
-                if module["module_name"] == module_info["module_name"] and module["status"] == module_info["status"]:
-                    modules_db[api_key]["modules"].remove(module)
-                    break
+    def get_pair_skip(self, api_key: str, skip=None):
+        # accounts of one pair must not trade from one ip, mobile proxy changes ip for every account
+        first_proxy = self.get_account_proxy(api_key)
+        if first_proxy in [None, "mobile"]:
+            return skip
+        return lambda pair_key: (skip is not None and skip(pair_key)) or self.get_account_proxy(pair_key) == first_proxy
 
-            if mode not in [1, 2] or [module["status"] for module in modules_db[api_key]["modules"]].count('to_run') == 0: # if no modules left for this account
-                last = True
+    @metrics.timed("db_operation_seconds")
+    def get_random_module(self, mode: int, skip=None):
+        self.get_password()
 
-            return {
-                'api_key': self.decode_pk(pk=api_key),
-                'encoded_api_key': api_key,
-                'label': modules_db[api_key]["label"],
-                'proxy': modules_db[api_key].get("proxy"),
-                'module_info': module_info,
-                'last': last
-            }
+        scheduler = self.get_scheduler()
+        if scheduler.accs_left == 0:
+            return 'No more accounts left'
 
-    def get_pair_modules(self):
+        api_key = scheduler.pick(skip)
+        if api_key is None:  # all accounts left are busy
+            return None
+        try:
+            account = self.storage.get_account(api_key)
+            module_data = self.build_module_data(api_key, account)
+        except:
+            scheduler.release(api_key, self.count_to_run(self.storage.get_account(api_key)))
+            raise
+
+        # picked module is the only one `to_run` left for this account
+        module_data["last"] = mode not in [1, 2] or self.count_to_run(account) == 1
+        return module_data
+
+    @metrics.timed("db_operation_seconds")
+    def get_pair_modules(self, skip=None):
         self.get_password()
 
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-
-        accs_left = len(set([acc for acc in modules_db for module in modules_db[acc]["modules"] if module["status"] == "to_run"]))
-        if accs_left < 2:
-            if accs_left:
+        scheduler = self.get_scheduler()
+        if scheduler.accs_left < 2:
+            if scheduler.accs_left:
                 logger.warning(f'[•] Soft | 1 Account left without pair!')
             return 'No more accounts left'
 
-        index = 0
-        pair_modules = []
-        while True:
-            if SHUFFLE_WALLETS: api_key = choice(list(modules_db.keys()))
-            else: api_key = list(modules_db.keys())[index]
-            account_modules = [module for module in modules_db[api_key]["modules"] if module["status"] == "to_run"]
-            if (
-                    not account_modules or
-                    api_key in [acc["encoded_api_key"] for acc in pair_modules]
-            ):
-                index += 1
-                continue
-            module_info = choice(account_modules)
-            pair_modules.append({
-                'api_key': self.decode_pk(pk=api_key),
-                'encoded_api_key': api_key,
-                'label': modules_db[api_key]["label"],
-                'proxy': modules_db[api_key].get("proxy"),
-                'module_info': module_info,
-            })
+        pair_keys = [scheduler.pick(skip)]
+        if pair_keys[0] is None:
+            pair_keys.append(None)
+        else:
+            # second account with closest balance, so `open_futures` dont fail on low balance of one side
+            pair_keys.append(scheduler.pick_pair(pair_keys[0], self.get_pair_skip(pair_keys[0], skip)))
+            if pair_keys[1] is None:  # only accounts behind the same proxy are left
+                pair_keys[1] = scheduler.pick_pair(pair_keys[0], skip)
+        if None in pair_keys:  # accounts left are busy
+            for api_key in pair_keys:
+                if api_key is not None:
+                    scheduler.release(api_key, self.count_to_run(self.storage.get_account(api_key)))
+            return None
+        try:
+            pair_modules = [self.build_module_data(api_key, self.storage.get_account(api_key)) for api_key in pair_keys]
+        except:
+            for api_key in pair_keys:
+                scheduler.release(api_key, self.count_to_run(self.storage.get_account(api_key)))
+            raise
 
-            if len(pair_modules) == 2:
-                return pair_modules
+        return pair_modules
 
 
+    @metrics.timed("db_operation_seconds")
     def remove_module(self, module_data: dict):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
+        account = self.storage.get_account(module_data["encoded_api_key"])
 
-        for index, module in enumerate(modules_db[module_data["encoded_api_key"]]["modules"]):
+        for index, module in enumerate(account["modules"]):
             if module["module_name"] == module_data["module_info"]["module_name"] and module["status"] == "to_run":
                 if module_data["module_info"]["status"] in [True, "completed"]:
                     self.window_name.add_module()
-                    modules_db[module_data["encoded_api_key"]]["modules"].remove(module)
-                    modules_db[module_data["encoded_api_key"]]["retries"] = 0
+                    account["modules"].remove(module)
+                    account["retries"] = 0
                 else:
-                    if modules_db[module_data["encoded_api_key"]]["retries"] + 1 >= RETRY:
-                        modules_db[module_data["encoded_api_key"]]["retries"] = 0
-                        modules_db[module_data["encoded_api_key"]]["modules"][index]["status"] = "failed"
+                    if account["retries"] + 1 >= RETRY:
+                        account["retries"] = 0
+                        account["modules"][index]["status"] = "failed"
                         self.window_name.add_module()
                     else:
-                        modules_db[module_data["encoded_api_key"]]["retries"] += 1
+                        account["retries"] += 1
                 break
 
-        if [module["status"] for module in modules_db[module_data["encoded_api_key"]]["modules"]].count('to_run') == 0:
-            self.report_total_pnl(encoded_key=module_data["encoded_api_key"])
+        if self.count_to_run(account) == 0:
+            self.report_total_pnl(encoded_key=module_data["encoded_api_key"], account=account)
             self.window_name.add_acc()
             send_reports = True
         else:
             send_reports = False
 
-        if not modules_db[module_data["encoded_api_key"]]["modules"]:
-            del modules_db[module_data["encoded_api_key"]]
-
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(modules_db, f)
+        # claim is dropped only together with saved account, so other process never takes old modules
+        with self.storage.transaction():
+            if not account["modules"]:
+                self.storage.delete_account(module_data["encoded_api_key"])
+            else:
+                self.storage.save_account(module_data["encoded_api_key"], account)
+            self.get_scheduler().release(module_data["encoded_api_key"], self.count_to_run(account))
         return send_reports
 
+    @metrics.timed("db_operation_seconds")
     def remove_account(self, module_data: dict):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
+        account = self.storage.get_account(module_data["encoded_api_key"])
 
         self.window_name.add_acc()
         if module_data["module_info"]["status"] in [True, "completed"]:
             send_reports = True
-            self.report_total_pnl(encoded_key=module_data["encoded_api_key"])
-            del modules_db[module_data["encoded_api_key"]]
+            self.report_total_pnl(encoded_key=module_data["encoded_api_key"], account=account)
+            with self.storage.transaction():
+                self.storage.delete_account(module_data["encoded_api_key"])
+                self.get_scheduler().release(module_data["encoded_api_key"], 0)
+            return send_reports
 
         else:
-            if modules_db[module_data["encoded_api_key"]]["retries"] + 1 >= RETRY:
-                modules_db[module_data["encoded_api_key"]]["retries"] = 0
-                modules_db[module_data["encoded_api_key"]]["modules"] = [{
+            if account["retries"] + 1 >= RETRY:
+                account["retries"] = 0
+                account["modules"] = [{
                     "module_name": module_data["module_info"]["module_name"],
                     "status": "failed"
                 }]
                 send_reports = True
-                self.report_total_pnl(encoded_key=module_data["encoded_api_key"])
+                self.report_total_pnl(encoded_key=module_data["encoded_api_key"], account=account)
             else:
-                modules_db[module_data["encoded_api_key"]]["retries"] += 1
+                account["retries"] += 1
                 send_reports = False
 
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(modules_db, f)
+        with self.storage.transaction():
+            self.storage.save_account(module_data["encoded_api_key"], account)
+            self.get_scheduler().release(module_data["encoded_api_key"], self.count_to_run(account))
         return send_reports
 
+    @metrics.timed("db_operation_seconds")
     def remove_pairs(self, pair_modules: list, completed: bool):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-
         for module_data in pair_modules:
-            for index, module in enumerate(modules_db[module_data["encoded_api_key"]]["modules"]):
+            account = self.storage.get_account(module_data["encoded_api_key"])
+
+            for index, module in enumerate(account["modules"]):
                 if module["module_name"] == module_data["module_info"]["module_name"] and module["status"] == "to_run":
                     if completed:
                         self.window_name.add_module()
-                        modules_db[module_data["encoded_api_key"]]["modules"].remove(module)
-                        modules_db[module_data["encoded_api_key"]]["retries"] = 0
+                        account["modules"].remove(module)
+                        account["retries"] = 0
                     else:
-                        if modules_db[module_data["encoded_api_key"]]["retries"] + 1 >= RETRY:
-                            modules_db[module_data["encoded_api_key"]]["retries"] = 0
-                            modules_db[module_data["encoded_api_key"]]["modules"][index]["status"] = "failed"
+                        if account["retries"] + 1 >= RETRY:
+                            account["retries"] = 0
+                            account["modules"][index]["status"] = "failed"
                             self.window_name.add_module()
                         else:
-                            modules_db[module_data["encoded_api_key"]]["retries"] += 1
-
-                    if not modules_db[module_data["encoded_api_key"]]["modules"]:
-                        del modules_db[module_data["encoded_api_key"]]
-
+                            account["retries"] += 1
                     break
+            if module_data["encoded_api_key"] in self.balances:
+                # saved, so pairs are matched by balance right after restart
+                account["usdc_balance"] = self.balances[module_data["encoded_api_key"]]
 
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(modules_db, f)
+            with self.storage.transaction():
+                if not account["modules"]:
+                    self.storage.delete_account(module_data["encoded_api_key"])
+                else:
+                    self.storage.save_account(module_data["encoded_api_key"], account)
+                self.get_scheduler().release(module_data["encoded_api_key"], self.count_to_run(account))
 
 
+    @metrics.timed("db_operation_seconds")
     def add_futures_to_sell(self, futures_to_sell: dict, event_name: str):
-        with open(self.sell_futures_db_name, encoding="utf-8") as f: futures_db = json.load(f)
-        futures_db[event_name] = futures_to_sell
-        with open(self.sell_futures_db_name, 'w', encoding="utf-8") as f: json.dump(futures_db, f)
+        self.storage.add_future(event_name, futures_to_sell)
 
-    def get_random_futures_to_sell(self):
+    @metrics.timed("db_operation_seconds")
+    def get_random_futures_to_sell(self, skip=None):
         self.get_password()
 
-        with open(self.sell_futures_db_name, encoding="utf-8") as f: futures_db = json.load(f)
-        if not futures_db:
-            return None
+        if SHARED_DATABASE["enabled"]:
+            event_name = self.get_scheduler().pick_future(skip)
+            if event_name is None:
+                return None
+            future = self.storage.get_future(event_name)
+        else:
+            futures_db = self.storage.get_futures()
+            # futures being sold right now by other pair of this process are not available
+            free_futures = [
+                event_name for event_name in futures_db
+                if event_name not in self.futures_busy and not (
+                    skip and any(skip(account) for account in futures_db[event_name]["accounts"])
+                )
+            ]
+            if not free_futures:
+                return None
+            event_name = choice(free_futures)
+            future = futures_db[event_name]
+            self.futures_busy.add(event_name)
 
         pair_modules = []
-        event_name = choice(list(futures_db.keys()))
-        for account_data in futures_db[event_name]["accounts"]:
+        for account_data in future["accounts"]:
             pair_modules.append({
                 **account_data,
                 'api_key': self.decode_pk(pk=account_data["encoded_api_key"])
@@ -383,55 +517,50 @@ class DataBase:
         return {
             "event_name": event_name,
             "pair_modules": pair_modules,
-            "info": futures_db[event_name]["info"]
+            "info": future["info"]
         }
 
+    @metrics.timed("db_operation_seconds")
     def remove_future_to_sell(self, event_name: str):
-        with open(self.sell_futures_db_name, encoding="utf-8") as f: futures_db = json.load(f)
-
-        del futures_db[event_name]
-        with open(self.sell_futures_db_name, 'w', encoding="utf-8") as f: json.dump(futures_db, f)
+        self.release_future_to_sell(event_name)
+        self.storage.delete_future(event_name)
         self.window_name.add_acc()
 
+    @metrics.timed("db_operation_seconds")
+    def release_future_to_sell(self, event_name: str):
+        self.futures_busy.discard(event_name)
+        if SHARED_DATABASE["enabled"]:
+            self.get_scheduler().release_future(event_name)
+
 
     def add_account_pnl(self, encoded_key: str, bids_spend: float):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        modules_db[encoded_key]["total_pnl"] += bids_spend
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(modules_db, f)
-
-    def report_total_pnl(self, encoded_key: str):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        if modules_db[encoded_key].get('total_pnl'):
-            if round(modules_db[encoded_key]['total_pnl'], 3) >= 0:
-                total_pnl = f"+{round(modules_db[encoded_key]['total_pnl'], 3)}"
+        self.storage.add_pnl(encoded_key, bids_spend)
+
+    def report_total_pnl(self, encoded_key: str, account: dict | None = None):
+        if account is None:
+            account = self.storage.get_account(encoded_key)
+        if account.get('total_pnl'):
+            if round(account['total_pnl'], 3) >= 0:
+                total_pnl = f"+{round(account['total_pnl'], 3)}"
             else:
-                total_pnl = f"-{round(abs(modules_db[encoded_key]['total_pnl']), 3)}"
+                total_pnl = f"-{round(abs(account['total_pnl']), 3)}"
             self.append_report(
                 key=encoded_key,
                 text=f"\n📈 Bids PNL: {total_pnl}$"
             )
 
 
+    @metrics.timed("db_operation_seconds")
     def append_report(self, key: str, text: str, success: bool | str = None, unique_msg: bool = False):
-        with open(self.report_db_name, encoding="utf-8") as f: report_db = json.load(f)
-
-        if not report_db.get(key): report_db[key] = {'texts': [], 'success_rate': [0, 0]}
-
-        if (
-                unique_msg and
-                report_db[key]["texts"] and
-                report_db[key]["texts"][-1] == self.STATUS_SMILES[success] + text
-        ):
-            return
-
-        report_db[key]["texts"].append(self.STATUS_SMILES[success] + text)
-        if success in [False, True]:
-            report_db[key]["success_rate"][1] += 1
-            if success: report_db[key]["success_rate"][0] += 1
-
-        with open(self.report_db_name, 'w') as f: json.dump(report_db, f)
+        self.storage.append_report(
+            key=key,
+            text=self.STATUS_SMILES[success] + text,
+            success=success,
+            unique_msg=unique_msg,
+        )
 
 
+    @metrics.timed("db_operation_seconds")
     def get_account_reports(
             self,
             key: str,
@@ -439,8 +568,6 @@ class DataBase:
             account_index: str | None = None,
             get_rate: bool = False,
     ):
-        with open(self.report_db_name, encoding="utf-8") as f: report_db = json.load(f)
-
         if account_index is None:
             account_index = f"[{self.window_name.accs_done}/{self.window_name.accs_amount}]"
         elif account_index is False:
@@ -454,13 +581,14 @@ class DataBase:
         if header_string:
             header_string += "\n\n"
 
-        if report_db.get(key):
-            account_reports = report_db[key]
-            if get_rate: return f'{account_reports["success_rate"][0]}/{account_reports["success_rate"][1]}'
-            del report_db[key]
-
-            with open(self.report_db_name, 'w', encoding="utf-8") as f: json.dump(report_db, f)
+        if get_rate:
+            account_reports = self.storage.get_reports(key)
+            if account_reports:
+                return f'{account_reports["success_rate"][0]}/{account_reports["success_rate"][1]}'
+        else:
+            account_reports = self.storage.pop_reports(key)
 
+        if account_reports:
             logs_text = '\n'.join(account_reports['texts'])
             tg_text = f'{header_string}{logs_text}'
             if account_reports["success_rate"][1]:
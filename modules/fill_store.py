@@ -0,0 +1,122 @@
+from datetime import datetime, timezone
+from os import path, makedirs
+from hashlib import md5
+from time import time
+import json
+
+
+FILL_FIELDS = ["tradeId", "orderId", "symbol", "side", "price", "quantity", "timestamp"]
+
+
+def fill_timestamp(fill: dict):
+    timestamp = datetime.fromisoformat(fill["timestamp"])
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def fill_id(fill: dict):
+    if fill.get("tradeId") is not None:
+        return fill["tradeId"]
+    return f'{fill["orderId"]}:{fill["timestamp"]}:{fill["quantity"]}'
+
+
+class FillStore:
+
+    stores: dict = {}
+    fills_dir: str = 'databases/fills'
+
+    def __init__(self, store_name: str):
+        self.store_name = store_name
+        self.fills_amount = 0
+        self.watermark = 0          # ms timestamp of the newest stored fill
+        self.watermark_ids = set()  # fills with newest timestamp, `from` param returns them again
+
+        for fill in self.iter_fills():
+            self.add(fill)
+
+    @classmethod
+    def get(cls, api_key: str):
+        # one store per api key for the whole process
+        public_key = api_key.split(':')[0]
+        if public_key not in cls.stores:
+            makedirs(cls.fills_dir, exist_ok=True)
+            cls.stores[public_key] = cls(path.join(cls.fills_dir, f"{md5(public_key.encode()).hexdigest()}.jsonl"))
+        return cls.stores[public_key]
+
+    def add(self, fill: dict):
+        timestamp = int(fill_timestamp(fill) * 1e3)
+        if timestamp > self.watermark:
+            self.watermark = timestamp
+            self.watermark_ids = {fill_id(fill)}
+        elif timestamp == self.watermark:
+            self.watermark_ids.add(fill_id(fill))
+        self.fills_amount += 1
+
+    def iter_fills(self):
+        if not path.isfile(self.store_name):
+            return
+        with open(self.store_name, encoding="utf-8") as f:
+            for line in f:
+                if line.endswith("\n"):
+                    yield json.loads(line)
+
+    def merge(self, new_fills: list):
+        stored_ids = set(self.watermark_ids)
+        to_store = []
+        for fill in sorted(new_fills, key=fill_timestamp):
+            if int(fill_timestamp(fill) * 1e3) < self.watermark or fill_id(fill) in stored_ids:
+                continue
+            stored_ids.add(fill_id(fill))
+            fill = {field: fill.get(field) for field in FILL_FIELDS}
+            to_store.append(fill)
+            self.add(fill)
+
+        if to_store:
+            with open(self.store_name, 'a', encoding="utf-8") as f:
+                f.write("".join(json.dumps(fill) + "\n" for fill in to_store))
+        return to_store
+
+
+class FillStats:
+
+    def __init__(self, month_timestamp: float | None = None):
+        if month_timestamp is None:
+            month_timestamp = time() - 60 * 60 * 24 * 30
+        # fill timestamps are UTC ISO strings, so they can be compared as strings
+        self.month_start = datetime.fromtimestamp(month_timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+        self.volume = {"month": 0, "total": 0}
+        # distinct orders are counted exactly, so this is the only part growing with history: O(orders)
+        self.orders = {}            # order id -> order has fill in last month
+        self.month_orders = 0
+        self.days = {"month": set(), "total": set()}
+
+    def add(self, fill: dict):
+        volume = float(fill["price"]) * float(fill["quantity"])
+        day = fill["timestamp"][:10]
+        in_month = fill["timestamp"] >= self.month_start
+
+        self.volume["total"] += volume
+        self.days["total"].add(day)
+        counted_in_month = self.orders.get(fill["orderId"])
+        if not counted_in_month:
+            self.orders[fill["orderId"]] = in_month
+            if in_month:
+                self.month_orders += 1
+
+        if in_month:
+            self.volume["month"] += volume
+            self.days["month"].add(day)
+
+    def add_many(self, fills):
+        for fill in fills:
+            self.add(fill)
+        return self
+
+    def result(self):
+        return {
+            "volume": {"month": round(self.volume["month"], 2), "total": round(self.volume["total"], 2)},
+            "orders": {"month": self.month_orders, "total": len(self.orders)},
+            "days": {"month": len(self.days["month"]), "total": len(self.days["total"])},
+        }
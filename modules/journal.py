@@ -0,0 +1,185 @@
+from threading import Thread, Event, RLock
+from os import path, replace, fsync, remove
+import json
+
+from modules.utils import logger
+
+
+class ReportJournal:
+
+    def __init__(self, journal_name: str, legacy_db_name: str | None = None, compact_interval: int | None = 60):
+        self.journal_name = journal_name
+        self.lock = RLock()
+
+        self.index = {}
+        self.dead_lines = 0
+        self.live_lines = 0
+
+        if not path.isfile(self.journal_name):
+            open(self.journal_name, 'w').close()
+            if legacy_db_name and path.isfile(legacy_db_name):
+                self.migrate(legacy_db_name)
+
+        self.replay()
+        self.writer = open(self.journal_name, 'ab')
+        self.reader = open(self.journal_name, 'rb')
+
+        self.stopped = Event()
+        if compact_interval:
+            self.compact_interval = compact_interval
+            Thread(target=self.compact_loop, daemon=True).start()
+
+
+    def migrate(self, legacy_db_name: str):
+        with open(legacy_db_name, encoding="utf-8") as f: report_db = json.load(f)
+        if not report_db:
+            remove(legacy_db_name)
+            return
+
+        with open(self.journal_name, 'wb') as f:
+            for key, account_reports in report_db.items():
+                for text in account_reports["texts"]:
+                    f.write(self.encode({"k": key, "t": text, "s": None}))
+                f.write(self.encode({"k": key, "rate": account_reports["success_rate"]}))
+        remove(legacy_db_name)
+        logger.info(f'[+] Database | Moved {len(report_db)} reports from {legacy_db_name} to {self.journal_name}')
+
+    def replay(self):
+        offset = 0
+        with open(self.journal_name, 'rb+') as f:
+            for line in f:
+                if not line.endswith(b"\n"):  # torn tail after crash
+                    f.truncate(offset)
+                    break
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    self.dead_lines += 1
+                    offset += len(line)
+                    continue
+                self.apply(event, offset, len(line))
+                offset += len(line)
+
+    def apply(self, event: dict, offset: int, length: int):
+        key = event["k"]
+        if event.get("drop"):
+            if key in self.index:
+                self.dead_lines += len(self.index[key]["offsets"])
+                self.live_lines -= len(self.index[key]["offsets"])
+                del self.index[key]
+            self.dead_lines += 1
+            return
+
+        if key not in self.index:
+            self.index[key] = {"offsets": [], "last": None, "success_rate": [0, 0]}
+        account_index = self.index[key]
+        account_index["offsets"].append((offset, length))
+        self.live_lines += 1
+
+        if "rate" in event:
+            account_index["success_rate"][0] += event["rate"][0]
+            account_index["success_rate"][1] += event["rate"][1]
+        else:
+            account_index["last"] = event["t"]
+            if event["s"] in [False, True]:
+                account_index["success_rate"][1] += 1
+                if event["s"]: account_index["success_rate"][0] += 1
+
+    def encode(self, event: dict):
+        return (json.dumps(event, ensure_ascii=False) + "\n").encode()
+
+    def write(self, event: dict):
+        line = self.encode(event)
+        offset = self.writer.tell()
+        self.writer.write(line)
+        self.writer.flush()
+        self.apply(event, offset, len(line))
+
+
+    def append(self, key: str, text: str, success: bool | str, unique_msg: bool):
+        with self.lock:
+            if unique_msg and key in self.index and self.index[key]["last"] == text:
+                return
+            self.write({"k": key, "t": text, "s": success if success in [False, True] else None})
+
+    def get(self, key: str):
+        with self.lock:
+            if key not in self.index:
+                return None
+
+            texts = []
+            for offset, length in self.index[key]["offsets"]:
+                self.reader.seek(offset)
+                event = json.loads(self.reader.read(length))
+                if "t" in event:
+                    texts.append(event["t"])
+
+            return {"texts": texts, "success_rate": list(self.index[key]["success_rate"])}
+
+    def pop(self, key: str):
+        with self.lock:
+            account_reports = self.get(key)
+            if account_reports is not None:
+                self.write({"k": key, "drop": True})
+            return account_reports
+
+    def clear(self):
+        with self.lock:
+            self.writer.close()
+            self.reader.close()
+            open(self.journal_name, 'w').close()
+            self.writer = open(self.journal_name, 'ab')
+            self.reader = open(self.journal_name, 'rb')
+            self.index = {}
+            self.dead_lines = 0
+            self.live_lines = 0
+
+
+    def compact(self):
+        with self.lock:
+            temp_name = f"{self.journal_name}.tmp"
+            new_index = {}
+            offset = 0
+            with open(temp_name, 'wb') as f:
+                for key, account_index in self.index.items():
+                    new_offsets = []
+                    for old_offset, length in account_index["offsets"]:
+                        self.reader.seek(old_offset)
+                        line = self.reader.read(length)
+                        f.write(line)
+                        new_offsets.append((offset, length))
+                        offset += length
+                    new_index[key] = {**account_index, "offsets": new_offsets}
+                f.flush()
+                fsync(f.fileno())
+
+            self.writer.close()
+            self.reader.close()
+            replace(temp_name, self.journal_name)
+            self.writer = open(self.journal_name, 'ab')
+            self.reader = open(self.journal_name, 'rb')
+            self.index = new_index
+            self.dead_lines = 0
+
+    def compact_loop(self):
+        while not self.stopped.wait(self.compact_interval):
+            if self.dead_lines > 1000 and self.dead_lines > self.live_lines:
+                try:
+                    self.compact()
+                except Exception as err:
+                    logger.error(f'[-] Database | Failed to compact {self.journal_name}: {err}')
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            self.writer.close()
+            self.reader.close()
+
+
+def read_journal(journal_name: str):
+    if not path.isfile(journal_name):
+        return {}
+    journal = ReportJournal(journal_name, compact_interval=None)
+    reports = {key: journal.get(key) for key in journal.index}
+    journal.close()
+    return reports
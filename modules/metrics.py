@@ -0,0 +1,155 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from os import path, makedirs
+from time import perf_counter
+from loguru import logger
+
+import settings
+
+
+class Metrics:
+
+    BUCKETS: tuple = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    HELP: dict = {
+        "request_seconds":          "Exchange HTTP request latency by endpoint and proxy",
+        "requests_total":           "Exchange HTTP responses by endpoint and status code",
+        "request_errors_total":     "Exchange HTTP requests failed without response",
+        "orders_total":             "Orders sent by market and outcome",
+        "retries_total":            "Retried calls by module and error class",
+        "db_operation_seconds":     "Database operation time",
+        "active_workers":           "Accounts or pairs running right now",
+        "accounts_done":            "Accounts done in current mode",
+        "accounts_total":           "Accounts to run in current mode",
+    }
+
+    def __init__(self, enabled: bool, prefix: str = "backpack"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.metrics = {}       # name -> {"type": ..., "values": {labels: value}}
+        self.lock = Lock()      # metrics are read from server thread
+        self.server = None
+
+    def get_values(self, name: str, metric_type: str):
+        if name not in self.metrics:
+            self.metrics[name] = {"type": metric_type, "values": {}}
+        return self.metrics[name]["values"]
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled: return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.get_values(name, "counter")
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        if not self.enabled: return
+        with self.lock:
+            self.get_values(name, "gauge")[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled: return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.get_values(name, "histogram")
+            if key not in values:
+                values[key] = {"buckets": [0] * len(self.BUCKETS), "sum": 0, "count": 0}
+            histogram = values[key]
+            for index, bucket in enumerate(self.BUCKETS):
+                if value <= bucket:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def timed(self, name: str):
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, perf_counter() - started, operation=func.__name__)
+            return wrapper
+        return decorator
+
+
+    @staticmethod
+    def format_labels(labels: tuple, extra: tuple = ()):
+        labels = labels + extra
+        if not labels:
+            return ""
+        escaped = [
+            (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for key, value in labels
+        ]
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, metric in sorted(self.metrics.items()):
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {full_name} {metric['type']}")
+                for labels, value in metric["values"].items():
+                    if metric["type"] != "histogram":
+                        lines.append(f"{full_name}{self.format_labels(labels)} {value}")
+                        continue
+                    for bucket, bucket_count in zip(self.BUCKETS, value["buckets"]):
+                        lines.append(f"{full_name}_bucket{self.format_labels(labels, (('le', bucket),))} {bucket_count}")
+                    lines.append(f"{full_name}_bucket{self.format_labels(labels, (('le', '+Inf'),))} {value['count']}")
+                    lines.append(f"{full_name}_sum{self.format_labels(labels)} {round(value['sum'], 6)}")
+                    lines.append(f"{full_name}_count{self.format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int):
+        if not self.enabled or not port or self.server: return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        except OSError as err:
+            logger.warning(f'[-] Soft | Failed to start metrics server on port {port}: {err}')
+            return
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.debug(f'[+] Soft | Metrics are served on http://127.0.0.1:{port}/metrics')
+
+    def dump(self, file_name: str):
+        if not self.enabled or not self.metrics: return
+        if path.dirname(file_name):
+            makedirs(path.dirname(file_name), exist_ok=True)
+        with open(file_name, "w", encoding="utf-8") as f:
+            f.write(self.render())
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def proxy_label(proxy: str | None):
+    # credentials of proxy must not get into metrics
+    if not proxy:
+        return "none"
+    return proxy.split("://")[-1].split("@")[-1]
+
+
+metrics = Metrics(enabled=settings.METRICS["enabled"])
@@ -0,0 +1,83 @@
+from curl_cffi.requests import AsyncSession
+from random import uniform
+from time import time
+import asyncio
+
+from modules.utils import logger
+
+
+class PriceFeed:
+
+    def __init__(self, url: str, tokens: list, max_age: int):
+        self.url = url
+        self.tokens = tokens
+        self.max_age = max_age
+
+        self.prices = {}
+        self.updated = {}
+        self.task = None
+        self.connected = False
+        self.reconnects = 0
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.task and not self.task.done() and self.task.get_loop() is loop:
+            return
+        self.connected = False
+        self.task = loop.create_task(self.run())
+
+    def get_prices(self, tokens: list | None = None):
+        # only subscribed tokens, prices of other tokens must be taken from API
+        tokens = self.tokens if tokens is None else tokens
+        if not self.connected or any(token_name not in self.tokens for token_name in tokens):
+            return None
+
+        now = time()
+        for token_name in tokens:
+            if now - self.updated.get(token_name, 0) > self.max_age:
+                return None
+        return {**{token_name: self.prices[token_name] for token_name in tokens}, "USDC": 1}
+
+
+    async def run(self):
+        delay = 1
+        while True:
+            try:
+                await self.listen()
+                delay = 1
+            except asyncio.CancelledError:
+                self.connected = False
+                raise
+            except Exception as err:
+                logger.warning(f'[-] Soft | Price feed disconnected: {err}')
+
+            self.connected = False
+            self.reconnects += 1
+            await asyncio.sleep(delay + uniform(0, 1))
+            delay = min(delay * 2, 30)
+
+    async def listen(self):
+        async with AsyncSession(impersonate="chrome131") as session:
+            ws = await session.ws_connect(self.url)
+            try:
+                await ws.send_json({
+                    "method": "SUBSCRIBE",
+                    "params": [f"ticker.{token_name}_USDC" for token_name in self.tokens]
+                })
+                self.connected = True
+                logger.debug(f'[+] Soft | Price feed connected to {self.url}')
+
+                while True:
+                    message = await ws.recv_json(timeout=self.max_age * 3)
+                    self.on_message(message)
+            finally:
+                await ws.close()
+
+    def on_message(self, message: dict):
+        data = message.get("data")
+        if not data or data.get("e") != "ticker" or not data.get("s", "").endswith("_USDC"):
+            return
+
+        token_name = data["s"].removesuffix("_USDC")
+        self.prices[token_name] = float(data["c"])
+        self.updated[token_name] = time()
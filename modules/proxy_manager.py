@@ -0,0 +1,104 @@
+from curl_cffi.requests import AsyncSession
+from random import uniform
+from time import time
+import asyncio
+
+from modules.utils import logger
+
+
+class ProxyManager:
+
+    def __init__(
+            self,
+            proxy: str | None,
+            change_ip_link: str,
+            min_interval: float,
+            on_change=None,
+            timeout: float = 15,
+            max_attempts: int = 10,
+    ):
+        self.proxy = proxy if proxy not in ['http://log:pass@ip:port', '', None] else None
+        self.change_ip_link = change_ip_link
+        self.min_interval = min_interval
+        self.on_change = on_change
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+        self.generation = 0     # how many times ip was changed
+        self.claimed = 0        # generation already given to an account or pair
+        self.claimed_by = None  # pair which uses claimed generation, its second account gets the same ip
+        self.last_rotation = 0
+        self.task = None
+        self.lock = None
+        self.lock_loop = None
+
+    @property
+    def enabled(self):
+        return self.change_ip_link not in ['https://changeip.mobileproxy.space/?proxy_key=...&format=json', '']
+
+    def get_lock(self):
+        # main runs every mode in a new event loop
+        if self.lock_loop is not asyncio.get_running_loop():
+            self.lock = asyncio.Lock()
+            self.lock_loop = asyncio.get_running_loop()
+        return self.lock
+
+    def start_rotation(self, label: str):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.rotate(label))
+        return self.task
+
+    def prefetch(self, label: str = "Soft"):
+        # change ip for the next account while current one is sleeping
+        if self.enabled and self.generation == self.claimed:
+            self.start_rotation(label)
+
+    async def get_fresh_ip(self, label: str, owner: str | None = None):
+        if not self.enabled: return self.generation
+
+        async with self.get_lock():
+            rotating = self.task and not self.task.done()
+            # ip must not be changed while first account of the pair is still sending requests
+            if owner is not None and owner == self.claimed_by and self.generation == self.claimed and not rotating:
+                return self.generation
+
+            if self.generation == self.claimed or rotating:
+                await self.start_rotation(label)
+            self.claimed = self.generation
+            self.claimed_by = owner
+            return self.generation
+
+
+    async def rotate(self, label: str):
+        wait = self.min_interval - (time() - self.last_rotation)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        delay = 1
+        for attempt in range(self.max_attempts):
+            try:
+                async with AsyncSession() as session:
+                    r = await session.get(self.change_ip_link, timeout=self.timeout)
+
+                if 'mobileproxy' in self.change_ip_link and r.json().get('status') == 'OK':
+                    return self.rotated(label, r.json()["new_ip"])
+                elif not 'mobileproxy' in self.change_ip_link and r.status_code == 200:
+                    return self.rotated(label, r.text)
+                logger.error(f'[-] {label} | Proxy | Change IP error: {r.text} | {r.status_code} [{attempt+1}/{self.max_attempts}]')
+
+            except Exception as err:
+                logger.error(f'[-] {label} | Proxy | Change IP error: {err} [{attempt+1}/{self.max_attempts}]')
+
+            await asyncio.sleep(delay + uniform(0, delay))
+            delay = min(delay * 2, 60)
+
+        raise Exception(f'Failed to change proxy ip in {self.max_attempts} attempts')
+
+    def rotated(self, label: str, new_ip: str):
+        self.last_rotation = time()
+        self.generation += 1
+        if self.on_change:
+            self.on_change(self.proxy)
+        logger.debug(f'[+] {label} | Proxy | Successfully changed ip: {new_ip}')
+        return self.generation
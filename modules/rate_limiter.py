@@ -0,0 +1,106 @@
+from time import time
+import asyncio
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time()
+        self.blocked_until = 0
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float):
+        # token is taken right away, negative balance is the queue before this request
+        self.refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        return max(self.blocked_until - now, 0) + wait
+
+    def slow_down(self, retry_after: float | None):
+        now = time()
+        self.refill(now)
+        self.rate = max(self.base_rate / 8, self.rate / 2)
+        self.tokens = min(self.tokens, 0)
+        self.blocked_until = max(self.blocked_until, now + (retry_after or 1 / self.rate))
+
+    def speed_up(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate / 20)
+
+
+class RateLimiter:
+
+    ORDER_INSTRUCTIONS: list = ["orderExecute", "orderCancel", "orderCancelAll"]
+
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self.enabled = limits["enabled"]
+        self.buckets = {}
+        self.stats = {"requests": 0, "waited": 0, "wait_time": 0, "max_wait": 0, "limited": 0}
+
+    def endpoint_class(self, api_instruction: str | None):
+        if api_instruction is None:
+            return "public"
+        elif api_instruction in self.ORDER_INSTRUCTIONS:
+            return "order"
+        return "private"
+
+    def get_bucket(self, name: str, owner: str | None):
+        key = (name, owner)
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(rate=self.limits[name], burst=max(self.limits[name], 1))
+        return self.buckets[key]
+
+    def get_buckets(self, api_key: str, proxy: str | None, api_instruction: str | None):
+        endpoint_class = self.endpoint_class(api_instruction)
+        public_key = api_key.split(':')[0]
+        buckets = [self.get_bucket("proxy", proxy)]
+        if endpoint_class == "public":
+            # public limits are per ip, not per account
+            buckets.append(self.get_bucket("public", proxy))
+        else:
+            buckets.append(self.get_bucket("api_key", public_key))
+            buckets.append(self.get_bucket(endpoint_class, public_key))
+        return buckets
+
+    async def acquire(self, buckets: list):
+        if not self.enabled: return 0
+
+        now = time()
+        wait = max(bucket.reserve(now) for bucket in buckets)
+        self.stats["requests"] += 1
+        if wait > 0:
+            self.stats["waited"] += 1
+            self.stats["wait_time"] += wait
+            self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_response(self, buckets: list, status_code: int, retry_after: str | None):
+        if not self.enabled: return
+
+        if status_code == 429:
+            self.stats["limited"] += 1
+            try:
+                retry_after = float(retry_after)
+            except (TypeError, ValueError):
+                retry_after = None
+            for bucket in buckets:
+                bucket.slow_down(retry_after)
+        else:
+            for bucket in buckets:
+                bucket.speed_up()
+
+    def format_stats(self):
+        if not self.stats["requests"]:
+            return "no requests"
+        average_wait = round(self.stats["wait_time"] / self.stats["requests"], 3)
+        return (f'{self.stats["requests"]} requests, {self.stats["waited"]} queued, {average_wait}s avg wait, '
+                f'{round(self.stats["max_wait"], 2)}s max wait, {self.stats["limited"]} rate limited (429)')
@@ -1,8 +1,13 @@
 from settings import RETRY
-from time import sleep
+from random import uniform
+from time import sleep, time
+import asyncio
 
+from curl_cffi import CurlError
 from loguru import logger
 
+from modules.metrics import metrics
+
 from requests.exceptions import JSONDecodeError as json_error1
 from json.decoder import JSONDecodeError as json_error2
 
@@ -11,10 +16,57 @@ class CustomError(Exception): pass
 
 class DataBaseError(Exception): pass
 
+class HttpError(Exception):
+    def __init__(self, text: str, status_code: int, retry_after: str | None = None):
+        super().__init__(text)
+        self.status_code = status_code
+        try:
+            self.retry_after = float(retry_after)
+        except (TypeError, ValueError):
+            self.retry_after = None
+
+
+RETRY_POLICIES = {
+    "network":      {"retry": True, "delay": 1, "max_delay": 15},
+    "server":       {"retry": True, "delay": 2, "max_delay": 30},
+    "rate_limit":   {"retry": True, "delay": 5, "max_delay": 60},
+    "rejected":     {"retry": False},  # exchange said no, same request will fail again
+    "other":        {"retry": True, "delay": 2, "max_delay": 30},
+}
+REJECT_MARKERS = ["insufficient", "below the minimum", "quantity is too small", "invalid market", "not enabled"]
+
+
+def is_rejected(text) -> bool:
+    text = str(text).lower()
+    return any(marker in text for marker in REJECT_MARKERS)
+
+
+def classify_error(error: Exception):
+    if isinstance(error, HttpError):
+        if error.status_code == 429: return "rate_limit"
+        if error.status_code >= 500: return "server"
+    if isinstance(error, (CurlError, ConnectionError, TimeoutError)):
+        return "network"
+    if is_rejected(error):
+        return "rejected"
+    return "other"
+
+
+def get_retry_delay(error: Exception, error_class: str, attempt: int):
+    policy = RETRY_POLICIES[error_class]
+    max_delay = min(policy["max_delay"], policy["delay"] * 2 ** attempt)
+    delay = max_delay / 2 + uniform(0, max_delay / 2)
+    if getattr(error, "retry_after", None):
+        delay = max(delay, error.retry_after)
+    return delay
+
 
 def have_json(func):
     async def wrapper(*args, **kwargs):
         response = await func(*args, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            error_msg = response.text[:350].replace("\n", " ")
+            raise HttpError(f'{response.status_code} {error_msg}', response.status_code, response.headers.get("Retry-After"))
         try:
             response.json()
         except (json_error1, json_error2):
@@ -67,10 +119,13 @@ def async_retry(
         exceptions,
         retries: int = RETRY,
         not_except=CustomError,
-        to_raise: bool = True
+        to_raise: bool = True,
+        deadline: float = 120,
+        no_retry: tuple = (),
 ):
     def decorator(f):
         async def newfn(*args, **kwargs):
+            give_up_at = time() + deadline
             attempt = 0
             while attempt < retries:
                 try:
@@ -86,12 +141,18 @@ def async_retry(
                     except:
                         error_owner = "Soft"
 
+                    error_class = classify_error(e)
                     logger.error(f'[-] {error_owner} | {source} | {module_str} | {e} [{attempt+1}/{retries}]')
                     attempt += 1
-                    if attempt == retries:
-                        if to_raise: raise ValueError(f'{module_str}: {e}')
-                        else: return False
-                    else:
-                        sleep(2)
+                    if attempt < retries and RETRY_POLICIES[error_class]["retry"] and error_class not in no_retry:
+                        delay = get_retry_delay(e, error_class, attempt - 1)
+                        if time() + delay < give_up_at:
+                            metrics.inc("retries_total", module=module_str, error_class=error_class)
+                            await asyncio.sleep(delay)
+                            continue
+                        logger.warning(f'[-] {error_owner} | {source} | {module_str} | Deadline {deadline}s exceeded')
+
+                    if to_raise: raise ValueError(f'{module_str}: {e}')
+                    else: return False
         return newfn
     return decorator
@@ -0,0 +1,231 @@
+from collections import OrderedDict
+from bisect import bisect_left, insort
+from random import randrange
+from math import floor, log
+
+
+class RandomSet:
+
+    def __init__(self):
+        self.items = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def add(self, item):
+        if item in self.positions: return
+        self.positions[item] = len(self.items)
+        self.items.append(item)
+
+    def remove(self, item):
+        index = self.positions.pop(item)
+        last_item = self.items.pop()
+        if index < len(self.items):
+            self.items[index] = last_item
+            self.positions[last_item] = index
+
+    def random(self):
+        if self.items:
+            return self.items[randrange(len(self.items))]
+
+    def pick(self, skip=None):
+        if not skip:
+            return self.random()
+
+        for _ in range(8):
+            item = self.random()
+            if item is None or not skip(item):
+                return item
+        for item in self.items:
+            if not skip(item):
+                return item
+
+
+class RandomPolicy:
+
+    def __init__(self):
+        self.pool = RandomSet()
+
+    def push(self, key: str, remaining: int, first: bool = False):
+        self.pool.add(key)
+
+    def discard(self, key: str):
+        if key in self.pool: self.pool.remove(key)
+
+    def pick(self, skip=None):
+        return self.pool.pick(skip)
+
+
+class SequentialPolicy:
+
+    def __init__(self):
+        self.queue = OrderedDict()
+
+    def push(self, key: str, remaining: int, first: bool = False):
+        self.queue[key] = remaining
+        if first: self.queue.move_to_end(key, last=False)
+
+    def discard(self, key: str):
+        self.queue.pop(key, None)
+
+    def pick(self, skip=None):
+        for key in self.queue:
+            if not skip or not skip(key):
+                return key
+
+
+class MostRemainingPolicy:
+
+    def __init__(self):
+        self.buckets = {}
+        self.counts = {}
+        self.max_count = 0
+
+    def push(self, key: str, remaining: int, first: bool = False):
+        self.discard(key)
+        self.buckets.setdefault(remaining, RandomSet()).add(key)
+        self.counts[key] = remaining
+        self.max_count = max(self.max_count, remaining)
+
+    def discard(self, key: str):
+        if key in self.counts:
+            self.buckets[self.counts.pop(key)].remove(key)
+
+    def pick(self, skip=None):
+        while self.max_count and not self.buckets.get(self.max_count):
+            self.max_count -= 1
+
+        for count in range(self.max_count, 0, -1):
+            bucket = self.buckets.get(count)
+            if not bucket: continue
+            if not skip:
+                return bucket.random()
+            for key in bucket.items:
+                if not skip(key):
+                    return key
+
+
+class BalanceMatcher:
+
+    STEP: float = 1.05              # balances in one bucket differ by 5% at most
+
+    def __init__(self):
+        self.buckets = {}           # log-scale balance bucket -> free accounts with known balance
+        self.bucket_keys = []       # sorted non-empty buckets, their count depends on balance range only
+        self.key_buckets = {}
+        self.unknown = RandomPolicy()
+
+    def get_bucket(self, balance: float):
+        return floor(log(max(balance, 0.01), self.STEP))
+
+    def push(self, key: str, balance: float | None):
+        self.discard(key)
+        if balance is None:
+            self.unknown.push(key, 0)
+            return
+
+        bucket = self.get_bucket(balance)
+        if bucket not in self.buckets:
+            self.buckets[bucket] = RandomSet()
+            insort(self.bucket_keys, bucket)
+        self.buckets[bucket].add(key)
+        self.key_buckets[key] = bucket
+
+    def discard(self, key: str):
+        self.unknown.discard(key)
+        if key in self.key_buckets:
+            bucket = self.key_buckets.pop(key)
+            self.buckets[bucket].remove(key)
+            if not self.buckets[bucket]:
+                del self.buckets[bucket]
+                del self.bucket_keys[bisect_left(self.bucket_keys, bucket)]
+
+    def closest(self, bucket: int, skip=None):
+        index = bisect_left(self.bucket_keys, bucket)
+        left, right = index - 1, index
+        while left >= 0 or right < len(self.bucket_keys):
+            if right == len(self.bucket_keys) or (left >= 0 and bucket - self.bucket_keys[left] < self.bucket_keys[right] - bucket):
+                key = self.buckets[self.bucket_keys[left]].pick(skip)
+                left -= 1
+            else:
+                key = self.buckets[self.bucket_keys[right]].pick(skip)
+                right += 1
+            if key is not None:
+                return key
+
+    def pick(self, balance: float | None, skip=None):
+        # accounts without known balance are paired with each other, while they are left
+        if balance is not None:
+            return self.closest(self.get_bucket(balance), skip) or self.unknown.pick(skip)
+
+        key = self.unknown.pick(skip)
+        if key is None and self.bucket_keys:
+            key = self.closest(self.bucket_keys[len(self.bucket_keys) // 2], skip)
+        return key
+
+
+class ModuleScheduler:
+
+    POLICIES: dict = {
+        "random": RandomPolicy,
+        "sequential": SequentialPolicy,
+        "most_remaining": MostRemainingPolicy,
+    }
+
+    def __init__(self, policy: str, balances: dict | None = None):
+        if policy not in self.POLICIES:
+            raise ValueError(f'Invalid wallets order "{policy}". Valid orders: {", ".join(self.POLICIES)}')
+        self.policy = self.POLICIES[policy]()
+        self.remaining = {}
+        self.busy = set()
+        self.balances = balances    # last known USDC balances, second account of pair is picked by it
+        self.matcher = BalanceMatcher() if balances is not None else None
+
+    @property
+    def accs_left(self):
+        return len(self.remaining)
+
+    @property
+    def free_accs(self):
+        return len(self.remaining) - len(self.busy)
+
+    def add(self, key: str, remaining: int):
+        if remaining <= 0: return
+        self.remaining[key] = remaining
+        self.policy.push(key, remaining)
+        if self.matcher: self.matcher.push(key, self.balances.get(key))
+
+    def take(self, key: str):
+        self.policy.discard(key)
+        if self.matcher: self.matcher.discard(key)
+        self.busy.add(key)
+
+    def pick(self, skip=None):
+        key = self.policy.pick(skip)
+        if key is not None:
+            self.take(key)
+        return key
+
+    def pick_pair(self, key: str, skip=None):
+        if self.matcher is None:
+            return self.pick(skip)
+
+        pair_key = self.matcher.pick(self.balances.get(key), skip)
+        if pair_key is not None:
+            self.take(pair_key)
+        return pair_key
+
+    def release(self, key: str, remaining: int):
+        self.busy.discard(key)
+        if remaining <= 0:
+            self.remaining.pop(key, None)
+            self.policy.discard(key)
+            if self.matcher: self.matcher.discard(key)
+        else:
+            self.remaining[key] = remaining
+            self.policy.push(key, remaining, first=True)
+            if self.matcher: self.matcher.push(key, self.balances.get(key))
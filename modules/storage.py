@@ -0,0 +1,694 @@
+from threading import Thread, Event, RLock
+from os import path, replace, fsync, remove, mkdir
+from copy import deepcopy
+from hashlib import md5
+from time import time
+import sqlite3
+import json
+
+from modules.journal import ReportJournal, read_journal
+from modules.utils import logger
+
+
+def atomic_dump(name: str, data: dict | list):
+    temp_name = f"{name}.tmp"
+    with open(temp_name, 'w', encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        fsync(f.fileno())
+    replace(temp_name, name)
+
+
+def locked(func):
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+class StateCache:
+
+    def __init__(self, flush_every: int, flush_interval: int):
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self.lock = RLock()
+        self.docs = {}
+        self.dirty = set()
+        self.mutations = 0
+        self.last_flush = time()
+
+        self.stopped = Event()
+        self.flusher = Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
+
+    def load(self, name: str):
+        with self.lock:
+            if name not in self.docs:
+                with open(name, encoding="utf-8") as f: self.docs[name] = json.load(f)
+            return self.docs[name]
+
+    def dump(self, name: str, data: dict):
+        with self.lock:
+            self.docs[name] = data
+            self.dirty.add(name)
+            self.mutations += 1
+            if self.mutations >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            for name in self.dirty:
+                atomic_dump(name, self.docs[name])
+            self.dirty.clear()
+            self.mutations = 0
+            self.last_flush = time()
+
+    def flush_loop(self):
+        while not self.stopped.wait(1):
+            if self.dirty and time() - self.last_flush >= self.flush_interval:
+                try:
+                    self.flush()
+                except Exception as err:
+                    logger.error(f'[-] Database | Failed to save checkpoint: {err}')
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+
+
+class JsonStorage:
+
+    def __init__(
+            self,
+            modules_db_name: str,
+            report_db_name: str,
+            report_journal_name: str,
+            sell_futures_db_name: str,
+            shards_dir: str | None = None,
+            cache: StateCache | None = None,
+    ):
+        self.modules_db_name = modules_db_name
+        self.sell_futures_db_name = sell_futures_db_name
+        self.shards_dir = shards_dir
+        self.cache = cache
+        self.lock = cache.lock if cache else RLock()
+
+        for db_params in [
+            {"name": self.modules_db_name, "value": "{}"},
+            {"name": self.sell_futures_db_name, "value": "{}"},
+        ]:
+            if not path.isfile(db_params["name"]):
+                with open(db_params["name"], 'w') as f: f.write(db_params["value"])
+
+        self.reports = ReportJournal(report_journal_name, legacy_db_name=report_db_name)
+        self.migrate_shards()
+
+    def migrate_shards(self):
+        # sharding was turned off: merge shards back to single modules file
+        if self.shards_dir and path.isfile(path.join(self.shards_dir, "summary.json")):
+            accounts = self._load(self.modules_db_name) or {}
+            accounts.update(ShardedJsonStorage.read_shards(self.shards_dir, delete=True))
+            atomic_dump(self.modules_db_name, accounts)
+            logger.info(f'[+] Database | Merged {len(accounts)} accounts from shards to {self.modules_db_name}')
+
+    def _load(self, name: str):
+        if self.cache:
+            return self.cache.load(name)
+        with open(name, encoding="utf-8") as f: return json.load(f)
+
+    def _dump(self, name: str, data: dict):
+        if self.cache:
+            return self.cache.dump(name, data)
+        atomic_dump(name, data)
+
+    def close(self):
+        self.reports.close()
+        if self.cache:
+            self.cache.close()
+
+    def transaction(self):
+        # json database is used by one process only, lock is enough
+        return self.lock
+
+
+    # accounts
+    def get_accounts(self):
+        return self._load(self.modules_db_name)
+
+    def get_account(self, key: str):
+        return deepcopy(self._load(self.modules_db_name).get(key))
+
+    def first_account_key(self):
+        modules_db = self._load(self.modules_db_name)
+        if modules_db:
+            return list(modules_db.keys())[0]
+
+    @locked
+    def save_account(self, key: str, account: dict):
+        modules_db = self._load(self.modules_db_name)
+        modules_db[key] = account
+        self._dump(self.modules_db_name, modules_db)
+
+    @locked
+    def delete_account(self, key: str):
+        modules_db = self._load(self.modules_db_name)
+        if key in modules_db:
+            del modules_db[key]
+            self._dump(self.modules_db_name, modules_db)
+
+    @locked
+    def replace_accounts(self, accounts: dict):
+        self._dump(self.modules_db_name, accounts)
+
+    @locked
+    def add_pnl(self, key: str, amount: float):
+        modules_db = self._load(self.modules_db_name)
+        modules_db[key]["total_pnl"] += amount
+        self._dump(self.modules_db_name, modules_db)
+
+    @locked
+    def reset_failed(self):
+        modules_db = self._load(self.modules_db_name)
+        changed = False
+        for acc in modules_db:
+            for module in modules_db[acc]["modules"]:
+                if module["status"] == "failed":
+                    module["status"] = "to_run"
+                    changed = True
+        if changed:
+            self._dump(self.modules_db_name, modules_db)
+
+    def get_amounts(self):
+        modules_db = self._load(self.modules_db_name)
+        return {
+            'accs_amount': len(modules_db),
+            'modules_amount': sum([len(modules_db[acc]["modules"]) for acc in modules_db]),
+        }
+
+
+    # futures
+    def get_futures(self):
+        return self._load(self.sell_futures_db_name)
+
+    def get_future(self, event_name: str):
+        return self._load(self.sell_futures_db_name).get(event_name)
+
+    @locked
+    def add_future(self, event_name: str, future: dict):
+        futures_db = self._load(self.sell_futures_db_name)
+        futures_db[event_name] = future
+        self._dump(self.sell_futures_db_name, futures_db)
+
+    @locked
+    def delete_future(self, event_name: str):
+        futures_db = self._load(self.sell_futures_db_name)
+        del futures_db[event_name]
+        self._dump(self.sell_futures_db_name, futures_db)
+
+    def count_futures(self):
+        return len(self._load(self.sell_futures_db_name))
+
+
+    # reports
+    def append_report(self, key: str, text: str, success: bool | str, unique_msg: bool):
+        self.reports.append(key, text, success, unique_msg)
+
+    def get_reports(self, key: str):
+        return self.reports.get(key)
+
+    def pop_reports(self, key: str):
+        return self.reports.pop(key)
+
+    def clear_reports(self):
+        self.reports.clear()
+
+
+class ShardedJsonStorage(JsonStorage):
+
+    def __init__(
+            self,
+            modules_db_name: str,
+            report_db_name: str,
+            report_journal_name: str,
+            sell_futures_db_name: str,
+            shards_dir: str,
+            shards_count: int,
+            cache: StateCache | None = None,
+    ):
+        self.shards_count = shards_count
+        self.summary_name = path.join(shards_dir, "summary.json")
+        if not path.isdir(shards_dir):
+            mkdir(shards_dir)
+
+        super().__init__(
+            modules_db_name,
+            report_db_name,
+            report_journal_name,
+            sell_futures_db_name,
+            shards_dir=shards_dir,
+            cache=cache,
+        )
+
+    def migrate_shards(self):
+        if path.isfile(self.summary_name):
+            with open(self.summary_name, encoding="utf-8") as f: summary = json.load(f)
+            if summary["shards_count"] == self.shards_count:
+                return
+            accounts = self.read_shards(self.shards_dir, delete=True)
+        else:
+            accounts = {}
+
+        with open(self.modules_db_name, encoding="utf-8") as f: accounts.update(json.load(f) or {})
+        self.write_shards(accounts, dump=atomic_dump)
+        atomic_dump(self.modules_db_name, {})
+        if accounts:
+            logger.info(f'[+] Database | Split {len(accounts)} accounts to {self.shards_count} shards in {self.shards_dir}')
+
+    @staticmethod
+    def read_shards(shards_dir: str, delete: bool = False):
+        summary_name = path.join(shards_dir, "summary.json")
+        if not path.isfile(summary_name):
+            return {}
+        with open(summary_name, encoding="utf-8") as f: summary = json.load(f)
+
+        accounts = {}
+        for shard_id in range(summary["shards_count"]):
+            shard_name = path.join(shards_dir, f"shard_{shard_id:03}.json")
+            if path.isfile(shard_name):
+                with open(shard_name, encoding="utf-8") as f: accounts.update(json.load(f))
+                if delete: remove(shard_name)
+        if delete: remove(summary_name)
+        return accounts
+
+    def write_shards(self, accounts: dict, dump=None):
+        dump = dump or self._dump
+        shards = [{} for _ in range(self.shards_count)]
+        for key, account in accounts.items():
+            shards[self.shard_id(key)][key] = account
+
+        summary = {"shards_count": self.shards_count, "shards": {}}
+        for shard_id, shard in enumerate(shards):
+            dump(self.shard_name(shard_id), shard)
+            summary["shards"][str(shard_id)] = self.count_shard(shard)
+        dump(self.summary_name, summary)
+
+
+    def shard_id(self, key: str):
+        return int(md5(key.encode()).hexdigest(), 16) % self.shards_count
+
+    def shard_name(self, shard_id: int):
+        return path.join(self.shards_dir, f"shard_{shard_id:03}.json")
+
+    def count_shard(self, shard: dict):
+        return {
+            "accs": len(shard),
+            "modules": sum([len(shard[acc]["modules"]) for acc in shard]),
+            "failed": sum([
+                1
+                for acc in shard
+                for module in shard[acc]["modules"]
+                if module["status"] == "failed"
+            ]),
+        }
+
+    def get_summary(self):
+        return self._load(self.summary_name)
+
+    def save_shard(self, shard_id: int, shard: dict):
+        summary = self.get_summary()
+        summary["shards"][str(shard_id)] = self.count_shard(shard)
+        self._dump(self.shard_name(shard_id), shard)
+        self._dump(self.summary_name, summary)
+
+
+    # accounts
+    def get_accounts(self):
+        accounts = {}
+        for shard_id in range(self.shards_count):
+            accounts.update(self._load(self.shard_name(shard_id)))
+        return accounts
+
+    def get_account(self, key: str):
+        return deepcopy(self._load(self.shard_name(self.shard_id(key))).get(key))
+
+    def first_account_key(self):
+        for shard_id, counts in self.get_summary()["shards"].items():
+            if counts["accs"]:
+                return list(self._load(self.shard_name(int(shard_id))).keys())[0]
+
+    @locked
+    def save_account(self, key: str, account: dict):
+        shard_id = self.shard_id(key)
+        shard = self._load(self.shard_name(shard_id))
+        shard[key] = account
+        self.save_shard(shard_id, shard)
+
+    @locked
+    def delete_account(self, key: str):
+        shard_id = self.shard_id(key)
+        shard = self._load(self.shard_name(shard_id))
+        if key in shard:
+            del shard[key]
+            self.save_shard(shard_id, shard)
+
+    @locked
+    def replace_accounts(self, accounts: dict):
+        self.write_shards(accounts)
+
+    @locked
+    def add_pnl(self, key: str, amount: float):
+        shard_id = self.shard_id(key)
+        shard = self._load(self.shard_name(shard_id))
+        shard[key]["total_pnl"] += amount
+        self._dump(self.shard_name(shard_id), shard)
+
+    @locked
+    def reset_failed(self):
+        for shard_id, counts in self.get_summary()["shards"].items():
+            if not counts["failed"]: continue
+
+            shard = self._load(self.shard_name(int(shard_id)))
+            for acc in shard:
+                for module in shard[acc]["modules"]:
+                    if module["status"] == "failed": module["status"] = "to_run"
+            self.save_shard(int(shard_id), shard)
+
+    def get_amounts(self):
+        shards = self.get_summary()["shards"].values()
+        return {
+            'accs_amount': sum([counts["accs"] for counts in shards]),
+            'modules_amount': sum([counts["modules"] for counts in shards]),
+        }
+
+
+class SqliteStorage:
+
+    SCHEMA: str = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            key         TEXT PRIMARY KEY,
+            label       TEXT,
+            proxy       TEXT,
+            retries     INTEGER NOT NULL DEFAULT 0,
+            total_pnl   REAL NOT NULL DEFAULT 0,
+            usdc_balance REAL,
+            claimed_by  TEXT,
+            lease_until REAL
+        );
+        CREATE TABLE IF NOT EXISTS modules (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            account     TEXT NOT NULL REFERENCES accounts(key) ON DELETE CASCADE,
+            module_name TEXT NOT NULL,
+            status      TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS modules_account ON modules(account, status);
+        CREATE INDEX IF NOT EXISTS modules_status ON modules(status);
+        CREATE TABLE IF NOT EXISTS reports (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            key         TEXT NOT NULL,
+            text        TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS reports_key ON reports(key, id);
+        CREATE TABLE IF NOT EXISTS report_rates (
+            key         TEXT PRIMARY KEY,
+            success     INTEGER NOT NULL DEFAULT 0,
+            total       INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS futures (
+            event_name  TEXT PRIMARY KEY,
+            data        TEXT NOT NULL,
+            claimed_by  TEXT,
+            lease_until REAL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            name        TEXT PRIMARY KEY,
+            value       TEXT
+        );
+    """
+
+    def __init__(
+            self,
+            db_name: str,
+            modules_db_name: str,
+            report_db_name: str,
+            report_journal_name: str,
+            sell_futures_db_name: str,
+            shards_dir: str,
+    ):
+        self.db_name = db_name
+        self.conn = sqlite3.connect(db_name, isolation_level=None, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(self.SCHEMA)
+        for table in ["accounts", "futures"]:
+            columns = [column["name"] for column in self.conn.execute(f"PRAGMA table_info({table})")]
+            if "claimed_by" not in columns:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN claimed_by TEXT")
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN lease_until REAL")
+        if "usdc_balance" not in [column["name"] for column in self.conn.execute("PRAGMA table_info(accounts)")]:
+            self.conn.execute("ALTER TABLE accounts ADD COLUMN usdc_balance REAL")
+
+        self.migrate_from_json(modules_db_name, report_db_name, report_journal_name, sell_futures_db_name, shards_dir)
+
+    def close(self):
+        self.conn.close()
+
+    def transaction(self):
+        return SqliteTransaction(self.conn)
+
+
+    def migrate_from_json(
+            self,
+            modules_db_name: str,
+            report_db_name: str,
+            report_journal_name: str,
+            sell_futures_db_name: str,
+            shards_dir: str,
+    ):
+        with self.transaction():
+            if self.conn.execute("SELECT value FROM meta WHERE name = 'json_migrated'").fetchone():
+                return
+            self._import_json(modules_db_name, report_db_name, report_journal_name, sell_futures_db_name, shards_dir)
+
+    def _import_json(
+            self,
+            modules_db_name: str,
+            report_db_name: str,
+            report_journal_name: str,
+            sell_futures_db_name: str,
+            shards_dir: str,
+    ):
+        json_dbs = {}
+        for db_name in [modules_db_name, report_db_name, sell_futures_db_name]:
+            if path.isfile(db_name):
+                with open(db_name, encoding="utf-8") as f: json_dbs[db_name] = json.load(f) or {}
+            else:
+                json_dbs[db_name] = {}
+        json_dbs[modules_db_name].update(ShardedJsonStorage.read_shards(shards_dir))
+        json_dbs[report_db_name].update(read_journal(report_journal_name))
+
+        if json_dbs[modules_db_name]:
+            self._insert_accounts(json_dbs[modules_db_name])
+        for key, account_reports in json_dbs[report_db_name].items():
+            self.conn.executemany(
+                "INSERT INTO reports (key, text) VALUES (?, ?)",
+                [(key, text) for text in account_reports["texts"]]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO report_rates (key, success, total) VALUES (?, ?, ?)",
+                (key, *account_reports["success_rate"])
+            )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO futures (event_name, data) VALUES (?, ?)",
+            [(event_name, json.dumps(future)) for event_name, future in json_dbs[sell_futures_db_name].items()]
+        )
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('json_migrated', '1')")
+
+        if any(json_dbs.values()):
+            logger.info(f'[+] Database | Migrated {len(json_dbs[modules_db_name])} accounts, '
+                        f'{len(json_dbs[sell_futures_db_name])} futures pairs and '
+                        f'{len(json_dbs[report_db_name])} reports from json to {self.db_name}')
+
+    def _insert_accounts(self, accounts: dict):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO accounts (key, label, proxy, retries, total_pnl, usdc_balance) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    key, account["label"], account.get("proxy"), account.get("retries", 0),
+                    account.get("total_pnl", 0), account.get("usdc_balance"),
+                )
+                for key, account in accounts.items()
+            ]
+        )
+        self.conn.executemany(
+            "INSERT INTO modules (account, module_name, status) VALUES (?, ?, ?)",
+            [
+                (key, module["module_name"], module["status"])
+                for key, account in accounts.items()
+                for module in account["modules"]
+            ]
+        )
+
+    def _build_account(self, row: sqlite3.Row, modules: list):
+        return {
+            "modules": [{"module_name": module["module_name"], "status": module["status"]} for module in modules],
+            "proxy": row["proxy"],
+            "label": row["label"],
+            "retries": row["retries"],
+            "total_pnl": row["total_pnl"],
+            "usdc_balance": row["usdc_balance"],
+        }
+
+
+    # accounts
+    def get_accounts(self):
+        modules = {}
+        for module in self.conn.execute("SELECT account, module_name, status FROM modules ORDER BY id"):
+            modules.setdefault(module["account"], []).append(module)
+        return {
+            row["key"]: self._build_account(row, modules.get(row["key"], []))
+            for row in self.conn.execute("SELECT * FROM accounts ORDER BY rowid")
+        }
+
+    def get_account(self, key: str):
+        row = self.conn.execute("SELECT * FROM accounts WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        modules = self.conn.execute(
+            "SELECT module_name, status FROM modules WHERE account = ? ORDER BY id", (key,)
+        ).fetchall()
+        return self._build_account(row, modules)
+
+    def first_account_key(self):
+        row = self.conn.execute("SELECT key FROM accounts ORDER BY rowid LIMIT 1").fetchone()
+        if row:
+            return row["key"]
+
+    def save_account(self, key: str, account: dict):
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO accounts (key, label, proxy, retries, total_pnl, usdc_balance) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET label = excluded.label, proxy = excluded.proxy, "
+                "retries = excluded.retries, total_pnl = excluded.total_pnl, usdc_balance = excluded.usdc_balance",
+                (key, account["label"], account.get("proxy"), account["retries"], account["total_pnl"], account.get("usdc_balance"))
+            )
+            self.conn.execute("DELETE FROM modules WHERE account = ?", (key,))
+            self.conn.executemany(
+                "INSERT INTO modules (account, module_name, status) VALUES (?, ?, ?)",
+                [(key, module["module_name"], module["status"]) for module in account["modules"]]
+            )
+
+    def delete_account(self, key: str):
+        self.conn.execute("DELETE FROM accounts WHERE key = ?", (key,))
+
+    def replace_accounts(self, accounts: dict):
+        with self.transaction():
+            self.conn.execute("DELETE FROM modules")
+            self.conn.execute("DELETE FROM accounts")
+            self._insert_accounts(accounts)
+
+    def add_pnl(self, key: str, amount: float):
+        self.conn.execute("UPDATE accounts SET total_pnl = total_pnl + ? WHERE key = ?", (amount, key))
+
+    def reset_failed(self):
+        self.conn.execute("UPDATE modules SET status = 'to_run' WHERE status = 'failed'")
+
+    def get_amounts(self):
+        return {
+            'accs_amount': self.conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0],
+            'modules_amount': self.conn.execute("SELECT COUNT(*) FROM modules").fetchone()[0],
+        }
+
+
+    # futures
+    def get_futures(self):
+        return {
+            row["event_name"]: json.loads(row["data"])
+            for row in self.conn.execute("SELECT event_name, data FROM futures")
+        }
+
+    def get_future(self, event_name: str):
+        row = self.conn.execute("SELECT data FROM futures WHERE event_name = ?", (event_name,)).fetchone()
+        if row:
+            return json.loads(row["data"])
+
+    def add_future(self, event_name: str, future: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO futures (event_name, data) VALUES (?, ?)",
+            (event_name, json.dumps(future))
+        )
+
+    def delete_future(self, event_name: str):
+        self.conn.execute("DELETE FROM futures WHERE event_name = ?", (event_name,))
+
+    def count_futures(self):
+        return self.conn.execute("SELECT COUNT(*) FROM futures").fetchone()[0]
+
+
+    # reports
+    def append_report(self, key: str, text: str, success: bool | str, unique_msg: bool):
+        with self.transaction():
+            if unique_msg:
+                last_report = self.conn.execute(
+                    "SELECT text FROM reports WHERE key = ? ORDER BY id DESC LIMIT 1", (key,)
+                ).fetchone()
+                if last_report and last_report["text"] == text:
+                    return
+
+            self.conn.execute("INSERT INTO reports (key, text) VALUES (?, ?)", (key, text))
+            if success in [False, True]:
+                self.conn.execute(
+                    "INSERT INTO report_rates (key, success, total) VALUES (?, ?, 1) "
+                    "ON CONFLICT(key) DO UPDATE SET success = success + excluded.success, total = total + 1",
+                    (key, int(success))
+                )
+
+    def get_reports(self, key: str):
+        texts = [
+            row["text"]
+            for row in self.conn.execute("SELECT text FROM reports WHERE key = ? ORDER BY id", (key,))
+        ]
+        rate = self.conn.execute("SELECT success, total FROM report_rates WHERE key = ?", (key,)).fetchone()
+        if not texts and rate is None:
+            return None
+        return {
+            "texts": texts,
+            "success_rate": [rate["success"], rate["total"]] if rate else [0, 0],
+        }
+
+    def pop_reports(self, key: str):
+        with self.transaction():
+            account_reports = self.get_reports(key)
+            if account_reports:
+                self.conn.execute("DELETE FROM reports WHERE key = ?", (key,))
+                self.conn.execute("DELETE FROM report_rates WHERE key = ?", (key,))
+        return account_reports
+
+    def clear_reports(self):
+        with self.transaction():
+            self.conn.execute("DELETE FROM reports")
+            self.conn.execute("DELETE FROM report_rates")
+
+
+class SqliteTransaction:
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.nested = False
+
+    def __enter__(self):
+        # join outer transaction so several storage calls can commit together
+        self.nested = self.conn.in_transaction
+        if not self.nested:
+            self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.nested:
+            return
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
@@ -1,9 +1,9 @@
+from curl_cffi.requests import AsyncSession
 from inspect import getsourcefile
 from datetime import datetime
 from random import randint
-from requests import post
 from loguru import logger
-from time import sleep
+from time import sleep, time
 from tqdm import tqdm
 import asyncio
 import ctypes
@@ -12,12 +12,14 @@ import os
 sys.__stdout__ = sys.stdout # error with `import inquirer` without this string in some system
 from inquirer import prompt, List
 
+from modules.metrics import metrics
 import settings
 
 
 logger.remove()
 logger.add(sys.stderr, format="<white>{time:HH:mm:ss}</white> | <level>{message}</level>")
 windll = ctypes.windll if os.name == 'nt' else None # for Mac users
+running_workers = 0 # set by `WorkerPool`, bars of several workers mix up in one stderr
 
 
 class WindowName:
@@ -34,6 +36,8 @@ class WindowName:
         self.update_name()
 
     def update_name(self):
+        metrics.set("accounts_done", self.accs_done)
+        metrics.set("accounts_total", self.accs_amount)
         if os.name == 'nt':
             windll.kernel32.SetConsoleTitleW(f'Backpack [{self.accs_done}/{self.accs_amount}] | {self.path}')
 
@@ -66,7 +70,120 @@ class WindowName:
         self.update_name()
 
 
+class ShardWindowName(WindowName):
+    def __init__(self, accs_amount, shard_index: int, queue):
+        self.shard_index = shard_index
+        self.queue = queue
+        super().__init__(accs_amount)
+
+    def update_name(self):
+        # progress of child process is shown by launcher
+        self.queue.put(("progress", self.shard_index, self.accs_done, self.modules_done))
+
+
+class TgNotifier:
+
+    def __init__(
+            self,
+            bot_token: str,
+            user_ids: list,
+            api_url: str = "https://api.telegram.org",
+            batch_delay: float = 2,
+            max_length: int = 1900,
+    ):
+        self.bot_token = bot_token
+        self.user_ids = user_ids
+        self.api_url = api_url
+        self.batch_delay = batch_delay      # wait for more messages to send them in one
+        self.max_length = max_length
+
+        self.pending = {}                   # chat id -> texts not sent yet
+        self.chat_sent = {}                 # chat id -> last send time, telegram allows ~1 msg/sec per chat
+        self.last_sent = 0                  # and ~30 msg/sec per bot
+        self.task = None
+
+    def send(self, text: str):
+        if not self.bot_token or not text: return
+        for tg_id in self.user_ids:
+            self.pending.setdefault(tg_id, []).append(text)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # no event loop, will be sent by `flush`
+            return
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.worker())
+
+    def make_chunks(self, texts: list):
+        chunks = []
+        for text in texts:
+            for index in range(0, len(text), self.max_length):
+                part = text[index:index + self.max_length]
+                if chunks and len(chunks[-1]) + 1 + len(part) <= self.max_length:
+                    chunks[-1] += f'\n{part}'
+                else:
+                    chunks.append(part)
+        return chunks
+
+    async def worker(self):
+        async with AsyncSession() as session:
+            while self.pending:
+                await asyncio.sleep(self.batch_delay)
+                await asyncio.gather(*[
+                    self.send_texts(session, tg_id, self.pending.pop(tg_id))
+                    for tg_id in list(self.pending)
+                ])
+
+    async def send_texts(self, session, tg_id, texts: list):
+        for chunk in self.make_chunks(texts):
+            await self.send_chunk(session, tg_id, chunk)
+
+    async def send_chunk(self, session, tg_id, text: str, attempts: int = 5):
+        delay = 1
+        for attempt in range(attempts):
+            wait = max(self.chat_sent.get(tg_id, 0) + 1, self.last_sent + 1 / 30) - time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.chat_sent[tg_id] = self.last_sent = time()
+
+            try:
+                r = await session.post(
+                    f'{self.api_url}/bot{self.bot_token}/sendMessage',
+                    data={"parse_mode": "html", "chat_id": tg_id, "text": text},
+                    timeout=15,
+                )
+                error = r.json()
+            except Exception as err:
+                error = err
+            else:
+                if error.get("ok") == True:
+                    return True
+                if r.status_code == 429:
+                    delay = error.get("parameters", {}).get("retry_after", delay)
+                elif r.status_code < 500:
+                    break  # bad message or chat, no sense to repeat
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+        logger.error(f'[-] TG | Send Telegram message error to {tg_id}: {error}\n{text}')
+        return False
+
+    async def flush(self, timeout: float = 30):
+        if not self.pending and (self.task is None or self.task.done()):
+            return
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            self.task = asyncio.get_running_loop().create_task(self.worker())
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f'[-] TG | Failed to send {sum(len(texts) for texts in self.pending.values())} messages in {timeout}s')
+
+
 class TgReport:
+
+    notifier: TgNotifier = TgNotifier(bot_token=settings.TG_BOT_TOKEN, user_ids=settings.TG_USER_ID)
+
     def __init__(self, logs=""):
         self.logs = logs
 
@@ -76,21 +193,7 @@ class TgReport:
 
 
     def send_log(self, logs: str = None):
-        notification_text = logs or self.logs
-
-        texts = []
-        while len(notification_text) > 0:
-            texts.append(notification_text[:1900])
-            notification_text = notification_text[1900:]
-
-        if settings.TG_BOT_TOKEN:
-            for tg_id in settings.TG_USER_ID:
-                for text in texts:
-                    text = text.replace('+', '%2B')
-                    try:
-                        r = post(f'https://api.telegram.org/bot{settings.TG_BOT_TOKEN}/sendMessage?parse_mode=html&chat_id={tg_id}&text={text}')
-                        if r.json().get("ok") != True: raise Exception(r.json())
-                    except Exception as err: logger.error(f'[-] TG | Send Telegram message error to {tg_id}: {err}\n{text}')
+        self.notifier.send(logs or self.logs)
 
 
 def cround(number: float, digits: int):
@@ -101,6 +204,9 @@ def sleeping(*timing):
     if type(timing[0]) == list: timing = timing[0]
     if len(timing) == 2: x = randint(timing[0], timing[1])
     else: x = timing[0]
+    if running_workers > 1:
+        logger.info(f'[•] Sleeping {x}s')
+        return sleep(x)
     desc = datetime.now().strftime('%H:%M:%S')
     for _ in tqdm(range(x), desc=desc, bar_format='{desc} | [•] Sleeping {n_fmt}/{total_fmt}'):
         sleep(1)
@@ -109,8 +215,12 @@ async def async_sleeping(*timing):
     if type(timing[0]) == list: timing = timing[0]
     if len(timing) == 2: x = randint(timing[0], timing[1])
     else: x = timing[0]
-    logger.debug(f'[•] Sleeping {x} secs...')
-    await asyncio.sleep(x)
+    if running_workers > 1:
+        logger.info(f'[•] Sleeping {x}s')
+        return await asyncio.sleep(x)
+    desc = datetime.now().strftime('%H:%M:%S')
+    for _ in tqdm(range(x), desc=desc, bar_format='{desc} | [•] Sleeping {n_fmt}/{total_fmt}'):
+        await asyncio.sleep(1)
 
 
 def make_border(table_elements: dict):
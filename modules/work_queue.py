@@ -0,0 +1,152 @@
+from threading import Thread, Event
+from socket import gethostname
+from os import getpid
+from time import time
+import sqlite3
+import json
+
+from modules.storage import SqliteStorage
+from modules.utils import logger
+
+
+class WorkQueue:
+
+    ORDERS: dict = {
+        "random": "random()",
+        "sequential": "a.rowid",
+        "most_remaining": "(SELECT COUNT(*) FROM modules m WHERE m.account = a.key AND m.status = 'to_run') DESC, random()",
+    }
+
+    def __init__(self, storage: SqliteStorage, policy: str, lease: int, worker_id: str | None = None):
+        if policy not in self.ORDERS:
+            raise ValueError(f'Invalid wallets order "{policy}". Valid orders: {", ".join(self.ORDERS)}')
+
+        self.storage = storage
+        self.conn = storage.conn
+        self.order = self.ORDERS[policy]
+        self.lease = lease
+        self.worker_id = worker_id or f"{gethostname()}:{getpid()}"
+
+        self.stopped = Event()
+        Thread(target=self.heartbeat_loop, daemon=True).start()
+
+
+    @property
+    def accs_left(self):
+        return self.conn.execute(
+            "SELECT COUNT(DISTINCT account) FROM modules WHERE status = 'to_run'"
+        ).fetchone()[0]
+
+    @property
+    def free_accs(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM accounts a WHERE (a.claimed_by IS NULL OR a.lease_until < ?) AND "
+            "EXISTS (SELECT 1 FROM modules m WHERE m.account = a.key AND m.status = 'to_run')",
+            (time(),)
+        ).fetchone()[0]
+
+    def pick(self, skip=None):
+        now = time()
+        with self.storage.transaction():
+            candidates = self.conn.execute(
+                "SELECT a.key, a.claimed_by FROM accounts a "
+                "WHERE (a.claimed_by IS NULL OR a.lease_until < ?) AND "
+                "EXISTS (SELECT 1 FROM modules m WHERE m.account = a.key AND m.status = 'to_run') "
+                f"ORDER BY {self.order} LIMIT 64",
+                (now,)
+            ).fetchall()
+
+            for candidate in candidates:
+                if skip and skip(candidate["key"]): continue
+
+                if candidate["claimed_by"]:
+                    logger.warning(f'[!] Database | Lease of {candidate["claimed_by"]} expired, reclaiming account')
+                self.conn.execute(
+                    "UPDATE accounts SET claimed_by = ?, lease_until = ? WHERE key = ?",
+                    (self.worker_id, now + self.lease, candidate["key"])
+                )
+                return candidate["key"]
+
+    def pick_pair(self, key: str, skip=None):
+        # claims are made in sql by WALLETS_ORDER, balances are not indexed there
+        return self.pick(skip)
+
+    def release(self, key: str, remaining: int):
+        self.conn.execute(
+            "UPDATE accounts SET claimed_by = NULL, lease_until = NULL WHERE key = ? AND claimed_by = ?",
+            (key, self.worker_id)
+        )
+
+
+    def pick_future(self, skip=None):
+        now = time()
+        with self.storage.transaction():
+            candidates = self.conn.execute(
+                "SELECT event_name, data FROM futures WHERE claimed_by IS NULL OR lease_until < ? "
+                "ORDER BY random() LIMIT 16",
+                (now,)
+            ).fetchall()
+
+            for candidate in candidates:
+                # accounts of this pair must not be traded by other workers right now
+                accounts = json.loads(candidate["data"])["accounts"]
+                if skip and any(skip(account) for account in accounts): continue
+                keys = [account["encoded_api_key"] for account in accounts]
+                busy_accounts = self.conn.execute(
+                    f"SELECT COUNT(*) FROM accounts WHERE key IN ({', '.join('?' * len(keys))}) "
+                    f"AND claimed_by IS NOT NULL AND claimed_by != ? AND lease_until >= ?",
+                    (*keys, self.worker_id, now)
+                ).fetchone()[0]
+                if busy_accounts: continue
+
+                self.conn.execute(
+                    "UPDATE futures SET claimed_by = ?, lease_until = ? WHERE event_name = ?",
+                    (self.worker_id, now + self.lease, candidate["event_name"])
+                )
+                self.conn.execute(
+                    f"UPDATE accounts SET claimed_by = ?, lease_until = ? WHERE key IN ({', '.join('?' * len(keys))})",
+                    (self.worker_id, now + self.lease, *keys)
+                )
+                return candidate["event_name"]
+
+    def release_future(self, event_name: str):
+        with self.storage.transaction():
+            row = self.conn.execute(
+                "SELECT data FROM futures WHERE event_name = ? AND claimed_by = ?",
+                (event_name, self.worker_id)
+            ).fetchone()
+            if row is None:
+                return
+
+            keys = [account["encoded_api_key"] for account in json.loads(row["data"])["accounts"]]
+            self.conn.execute(
+                "UPDATE futures SET claimed_by = NULL, lease_until = NULL WHERE event_name = ?",
+                (event_name,)
+            )
+            self.conn.execute(
+                f"UPDATE accounts SET claimed_by = NULL, lease_until = NULL "
+                f"WHERE key IN ({', '.join('?' * len(keys))}) AND claimed_by = ?",
+                (*keys, self.worker_id)
+            )
+
+
+    def heartbeat_loop(self):
+        conn = sqlite3.connect(self.storage.db_name, isolation_level=None, timeout=30)
+        while not self.stopped.wait(max(self.lease // 3, 1)):
+            try:
+                for table in ["accounts", "futures"]:
+                    conn.execute(
+                        f"UPDATE {table} SET lease_until = ? WHERE claimed_by = ?",
+                        (time() + self.lease, self.worker_id)
+                    )
+            except Exception as err:
+                logger.error(f'[-] Database | Failed to renew leases: {err}')
+        conn.close()
+
+    def close(self):
+        self.stopped.set()
+        for table in ["accounts", "futures"]:
+            self.conn.execute(
+                f"UPDATE {table} SET claimed_by = NULL, lease_until = NULL WHERE claimed_by = ?",
+                (self.worker_id,)
+            )
@@ -0,0 +1,71 @@
+from random import uniform
+from time import time
+import asyncio
+
+from modules.metrics import metrics
+from modules import utils
+
+
+class WorkerPool:
+
+    def __init__(self, workers: int, per_proxy: int, start_delay: list, name: str = "accounts"):
+        self.name = name
+        self.workers = max(workers, 1)
+        self.per_proxy = max(per_proxy, 1)
+        self.start_delay = start_delay
+
+        self.proxies = {}       # proxy -> accounts running through it now
+        self.accounts = set()   # accounts running now
+        self.active = 0
+        self.next_start = 0
+        self.start_lock = asyncio.Lock()
+        self.released = asyncio.Event()
+
+    def proxy_free(self, proxy: str | None):
+        return self.proxies.get(proxy, 0) < self.per_proxy
+
+    def account_free(self, api_key: str, proxy: str | None):
+        return api_key not in self.accounts and self.proxy_free(proxy)
+
+    def take(self, proxies: list, accounts: list = ()):
+        for proxy in proxies:
+            self.proxies[proxy] = self.proxies.get(proxy, 0) + 1
+        self.accounts.update(accounts)
+        self.active += 1
+        metrics.set("active_workers", self.active, pool=self.name)
+
+    def release(self, proxies: list, accounts: list = ()):
+        for proxy in proxies:
+            self.proxies[proxy] -= 1
+            if self.proxies[proxy] <= 0:
+                del self.proxies[proxy]
+        self.accounts.difference_update(accounts)
+        self.active -= 1
+        metrics.set("active_workers", self.active, pool=self.name)
+        self.released.set()
+
+    async def wait_start(self):
+        # random gap between account starts, so accounts dont start trading in one second
+        if self.workers == 1: return
+        async with self.start_lock:
+            wait = self.next_start - time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.next_start = time() + uniform(*self.start_delay)
+
+    def prepare_wait(self):
+        # must be called before looking for free account, so release between look and wait isnt lost
+        self.released.clear()
+
+    async def wait_release(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.released.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, worker):
+        utils.running_workers += self.workers
+        try:
+            return await asyncio.gather(*[worker(index) for index in range(self.workers)])
+        finally:
+            utils.running_workers -= self.workers
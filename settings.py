@@ -1,6 +1,18 @@
 
 SHUFFLE_WALLETS     = True                  # True | False - перемешивать ли кошельки
+WALLETS_ORDER       = None                  # None - по SHUFFLE_WALLETS | "random" | "sequential" - по порядку | "most_remaining" - сначала кошельки с большим кол-вом модулей
 RETRY               = 3                     # кол-во попыток при ошибках / фейлах
+DATABASE_TYPE       = "json"                # "json" - база в json файлах | "sqlite" - база в `databases/database.sqlite` (WAL), быстрее на тысячах аккаунтов. старые json файлы переносятся автоматически
+SHARED_DATABASE     = {
+    "enabled":          False,              # True - несколько копий софта могут работать с одной базой (только для "sqlite"), аккаунт берет только одна копия
+    "lease":            300,                # через сколько секунд аккаунт упавшей копии софта снова станет доступен другим
+}
+DATABASE_SHARDS     = 0                     # 0 - все аккаунты в одном `modules.json` | 64 - делить аккаунты на 64 файла в `databases/modules/` (только для "json", для больших баз)
+DATABASE_CACHE      = {
+    "enabled":          False,              # True - держать json базы в памяти и сохранять на диск пачками (только для "json")
+    "flush_every":      20,                 # сохранять базы на диск после каждых 20 изменений
+    "flush_interval":   30,                 # и не реже чем раз в 30 секунд
+}
 
 # --- GENERAL SETTINGS ---
 TOKENS_TO_TRADE     = [                     # какие токены софт может тредить в паре с USDC
@@ -18,10 +30,41 @@ TRADES_AMOUNT       = {
 SLEEP_AFTER_ORDER   = [10, 20]              # задержка после каждого ордера 10-20 секунд (спот)
 SLEEP_AFTER_FUTURE  = [20, 40]              # задержка после каждого ордера 10-20 секунд (фьючи)
 SLEEP_AFTER_ACC     = [20, 40]              # задержка после каждого аккаунта 20-40 секунд
+CONCURRENCY         = {                     # сколько аккаунтов работают одновременно
+    "accounts":         1,                  # 1 - по одному аккаунту | 10 - до 10 аккаунтов параллельно (спот, продажа, парсинг)
+    "pairs":            1,                  # сколько пар фьючей открываются/закрываются одновременно
+    "per_proxy":        1,                  # сколько аккаунтов одновременно через один прокси (для "mobile" оставьте 1)
+    "start_delay":      [5, 30],            # задержка 5-30 секунд между запусками аккаунтов (если accounts больше 1)
+}
+PROCESSES           = 1                     # 1 - один процесс | 4 - разделить аккаунты на 4 процесса, по одному на ядро CPU, аккаунты одного прокси всегда в одном процессе (только для "sqlite", спот/продажа/парсинг)
+MARKET_DATA_TTL     = {                     # сколько секунд использовать уже полученные публичные данные биржи для всех аккаунтов
+    "tickers":          3,                  # цены токенов
+    "markets":          3600,               # информация о парах (знаки после запятой)
+}
+METRICS             = {
+    "enabled":          False,              # True - собирать метрики: время запросов к бирже, ответы, ордера, ретраи, время работы базы
+    "port":             0,                  # 9100 - отдавать метрики для Prometheus на http://127.0.0.1:9100/metrics | 0 - не запускать
+    "file":             "databases/metrics.prom",   # куда сохранять метрики при выходе
+}
+SESSION_POOL_SIZE   = 20                    # сколько открытых соединений (по одному на прокси) держать для повторного использования
+RATE_LIMITS         = {                     # сколько запросов в секунду можно отправлять бирже, при ответе 429 лимиты снижаются автоматически
+    "enabled":          True,               # False - отправлять запросы без ограничений
+    "api_key":          10,                 # на один API ключ
+    "proxy":            20,                 # на один прокси / IP
+    "public":           10,                 # публичные запросы (цены, пары) на один прокси / IP
+    "private":          5,                  # запросы аккаунта (балансы, история) на один API ключ
+    "order":            3,                  # ордера на один API ключ
+}
+PRICE_FEED          = {
+    "enabled":          False,              # True - получать цены токенов через websocket, без запроса к API перед каждым ордером
+    "url":              "wss://ws.backpack.exchange",
+    "max_age":          10,                 # если цена не обновлялась 10 секунд - брать ее через API
+}
 
 # --- PERP SETTINGS ---
 RANDOM_LEVERAGE     = [1, 5]                # рандомное плечо от 1х до 5х (макс 20х). меняется перед каждым кругом
 SELL_CHANCE         = 35                    # каждый раз шанс 35% на продажу одной пары купленных фьючей
+SIMULTANEOUS_LEGS   = False                 # True - открывать/закрывать обе ноги пары одновременно (без SLEEP_AFTER_FUTURE), если одна не открылась - вторая сразу закрывается
 
 
 # --- PERSONAL SETTINGS ---
@@ -29,6 +72,7 @@ SELL_CHANCE         = 35                    # каждый раз шанс 35% 
 PROXY_TYPE          = "mobile"                # "mobile" - для мобильных/резидентских прокси, указанных ниже | "file" - для статичных прокси из файла `proxies.txt`
 PROXY               = 'http://log:pass@ip:port' # что бы не использовать прокси - оставьте как есть
 CHANGE_IP_LINK      = 'https://changeip.mobileproxy.space/?proxy_key=...&format=json'
+CHANGE_IP_INTERVAL  = 10                    # минимум 10 секунд между сменами IP мобильного прокси
 
 TG_BOT_TOKEN        = ''                    # токен от тг бота (`12345:Abcde`) для уведомлений. если не нужно - оставляй пустым
 TG_USER_ID          = []                    # тг айди куда должны приходить уведомления. 
\ No newline at end of file